@@ -21,6 +21,25 @@
     graph. This file is read by the DawgDictionary class; see
     dawgdictionary.py
 
+    DawgBuilder also outputs the same graph in a packed binary form,
+    in a file with the extension '.dawg'. The binary format is described
+    in the _BinaryDawgPacker class below. DawgDictionary memory-maps
+    the binary file and navigates it in place, which makes loading
+    almost instantaneous.
+
+    DawgBuilder can also build a GADDAG instead of a DAWG (see Gordon,
+    "A faster Scrabble move generation algorithm", 1994). Each word is
+    added once for every split into a non-empty prefix and a suffix, as
+    the reversed prefix, followed by a separator ('+') and the suffix:
+    "care" is added as "c+are", "ac+re", "rac+e" and "erac", the last
+    one without a separator since the suffix is empty. A path through the
+    graph thus starts at any letter of a word and grows the word leftwards,
+    and then rightwards after the separator. The paths go through the same
+    node minimization and edge collapsing as the words of a DAWG, and are
+    written in the same formats, to files with the extensions '.gaddag'
+    and '.text.gaddag'. They are loaded by GaddagDictionary in
+    dawgdictionary.py.
+
     The output file is structured as a sequence of lines. Each line
     represents a node in the graph and contains information about
     outgoing edges from the node. Nodes are referred to by their
@@ -37,7 +56,9 @@
     The rest of the line is a sequence of edges where each edge
     is described by a prefix string followed by a colon (':')
     and the line number of the node following that edge. Edges are
-    separated by underscores ('_'). The prefix string can contain
+    separated by underscores ('_'), and appear in alphabetical order
+    of the first letter of their prefix, so that a traversal of the graph
+    finds words in alphabetical order. The prefix string can contain
     embedded vertical bars indicating that the previous character was
     a final character in a valid word.
 
@@ -60,15 +81,15 @@
 
     generates this output graph:
 
-    do:3_ca:2_ea:2
-    t|s:0_r|s:0
+    ca:2_do:3_ea:2
+    r|s:0_t|s:0
     |_g|s:0_ne:0
 
-    The root node in line 1 has three outgoing edges, "do" to node 3, "ca" to node 2, and "ea" to node 2.
+    The root node in line 1 has three outgoing edges, "ca" to node 2, "do" to node 3, and "ea" to node 2.
 
-    Node 2 (in line 2) has two edges, "t|s" to node 0 and "r|s" to node 0. This means that "cat" and
-    "cats", "eat" and "eats" are valid words (on the first edge), as well as "car" and "cars",
-    "ear" and "ears" (on the second edge).
+    Node 2 (in line 2) has two edges, "r|s" to node 0 and "t|s" to node 0. This means that "car" and
+    "cars", "ear" and "ears" are valid words (on the first edge), as well as "cat" and "cats",
+    "eat" and "eats" (on the second edge).
 
     Node 3 (in line 3) is itself a final node, denoted by the vertical bar at the start of the line.
     Thus, "do" (coming in from the root) is a valid word, but so are "dog" and "dogs" (on the first edge)
@@ -102,7 +123,7 @@ import binascii
 import struct
 import io
 
-from dawgdictionary import DawgDictionary
+from dawgdictionary import DawgDictionary, GADDAG_SEPARATOR
 
 from languages import Alphabet
 
@@ -136,10 +157,20 @@ class _DawgNode:
     # Zero is reserved for "None"
     _nextid = 1
 
+    # Position of each letter in the alphabetical order of edges
+    _EDGE_ORDER = dict((c, i) for i, c in enumerate(Alphabet.full_order))
+
+    @staticmethod
+    def sorted_edges(edges):
+        """ Return the (prefix, node) items of an edge dict in alphabetical order
+            of the first letter of the prefix, which is unique within a node """
+        order = _DawgNode._EDGE_ORDER
+        return sorted(edges.items(), key = lambda x: order.get(x[0][0], len(order)))
+
     @staticmethod
     def stringify_edges(edges, arr):
         """ Utility function to create a compact descriptor string and hashable key for node edges """
-        for prefix, node in edges.items():
+        for prefix, node in _DawgNode.sorted_edges(edges):
             arr.append(prefix + u':' + (u'0' if node is None else str(node.id)))
         return "_".join(arr)
 
@@ -181,12 +212,13 @@ class _DawgNode:
 
 class _Dawg:
 
-    def __init__(self):
+    def __init__(self, maxlen = MAXLEN):
+        self._maxlen = maxlen
         self._lastword = u''
         self._lastlen = 0
         self._root = dict()
         # Initialize empty list of starting dictionaries
-        self._dicts = [None] * MAXLEN
+        self._dicts = [None] * (maxlen + 1)
         self._dicts[0] = self._root
         # Initialize the result list of unique nodes
         self._unique_nodes = dict()
@@ -270,8 +302,8 @@ class _Dawg:
         """
         # Sanity check: make sure the word is not too long
         lenword = len(wrd)
-        if lenword >= MAXLEN:
-            raise ValueError("Word exceeds maximum length of {0} letters".format(MAXLEN))
+        if lenword >= self._maxlen:
+            raise ValueError("Word exceeds maximum length of {0} letters".format(self._maxlen))
         # First see how many letters we have in common with the
         # last word we processed
         i = 0
@@ -359,16 +391,49 @@ class _Dawg:
                     chars += len(prefix) - prefix.count(u'|')
         return chars
 
+    def _edges_info(self, edges, info):
+        """ Return a tuple with a bit pattern of the letters that occur on any path
+            along the given edges, and the shortest and longest word completions
+            along them, memoizing the results for nodes by id """
+        mask = 0
+        minlen = MAXLEN
+        maxlen = 0
+        for prefix, nd in edges.items():
+            mask |= Alphabet.letter_mask(prefix)
+            lenp = len(prefix) - prefix.count(u'|')
+            if nd is not None:
+                if nd.id not in info:
+                    info[nd.id] = self._edges_info(nd.edges, info)
+                nd_mask, nd_minlen, nd_maxlen = info[nd.id]
+                mask |= nd_mask
+                maxlen = max(maxlen, lenp + nd_maxlen)
+            else:
+                maxlen = max(maxlen, lenp)
+            if u'|' in prefix:
+                # A word is completed within the prefix
+                minlen = min(minlen, prefix.index(u'|'))
+            elif nd is None or nd.final:
+                # A word is completed at the end of the prefix
+                minlen = min(minlen, lenp)
+            else:
+                minlen = min(minlen, lenp + info[nd.id][1])
+        return mask, minlen, maxlen
+
     def write_packed(self, packer):
         """ Write the optimized DAWG to a packer """
-        packer.start(len(self._root))
+        # The dict of unique nodes may contain None, which is not a real node
+        num_nodes = sum(1 for node in self._unique_nodes.values() if node is not None)
+        # Calculate the bit pattern of the letters reachable from each node,
+        # as well as the shortest and longest word completions from it
+        info = dict()
+        packer.start(num_nodes, len(self._root), self._edges_info(self._root, info))
         # Start with the root edges
-        for prefix, nd in self._root.items():
-            packer.edge(nd.id, prefix)
+        for prefix, nd in _DawgNode.sorted_edges(self._root):
+            packer.edge(0 if nd is None else nd.id, prefix)
         for node in self._unique_nodes.values():
             if node is not None:
-                packer.node_start(node.id, node.final, len(node.edges))
-                for prefix, nd in node.edges.items():
+                packer.node_start(node.id, node.final, len(node.edges), info[node.id])
+                for prefix, nd in _DawgNode.sorted_edges(node.edges):
                     if nd is None:
                         packer.edge(0, prefix)
                     else:
@@ -392,39 +457,65 @@ class _BinaryDawgPacker:
 
     """ _BinaryDawgPacker packs the DAWG data to a byte stream.
 
-        !!! This is not fully implemented and not currently used by the
-        !!! DawgDictionary class in dawgdictionary.py
+        The resulting '.dawg' file is read by DawgDictionary.load_binary()
+        in dawgdictionary.py, which memory-maps it and navigates the nodes
+        directly from the buffer, without any parsing at load time.
 
         The stream format is as follows:
 
+        File header:
+            4 BYTES Signature, 'DAWG', or 'GDAG' for a GADDAG
+            BYTE Format version, currently 6
+            DWORD Number of nodes in the graph, not including the root
+            DWORD Length in bytes of the node data following the header
+            20 BYTES SHA-1 hash of the text file written along with the graph,
+                or zeros if there is none
+
+        The root node follows immediately after the file header. Its node header
+        never has the final bit set. Subsequent nodes are located via the offsets
+        in the edges leading to them.
+
         For each node:
             BYTE Node header
                 [feeeeeee]
                     f = final bit
                     eeee = number of edges
-            For each edge out of a node:
+            DWORD Bit pattern of the letters that occur on any path from the node,
+                with bits as in Alphabet.bit
+            BYTE Length of the shortest word completion from the node
+            BYTE Length of the longest word completion from the node
+            For each edge out of a node, in alphabetical order of the first prefix character:
                 BYTE Prefix header
                     [ftnnnnnn]
                     If t == 1 then
                         f = final bit of single prefix character
                         nnnnnn = single prefix character,
-                            coded as an index into AÁBDÐEÉFGHIÍJKLMNOÓPRSTUÚVXYÝÞÆÖ
+                            coded as an index into aábcdðeéfghiíjklmnoópqrstuúvwxyýzþæö+
                     else
                         00nnnnnn = number of prefix characters following
                         n * BYTE Prefix characters
                             [fccccccc]
                                 f = final bit
                                 ccccccc = prefix character,
-                                    coded as an index into AÁBDÐEÉFGHIÍJKLMNOÓPRSTUÚVXYÝÞÆÖ
-                DWORD Offset of child node
+                                    coded as an index into aábcdðeéfghiíjklmnoópqrstuúvwxyýzþæö+
+                DWORD Offset of child node, or 0 if the edge leads to a final
+                    node with no outgoing edges (None)
+
+        The last character in the coding, '+', is the GADDAG separator.
+        All multi-byte values are little-endian.
 
     """
 
-    CODING_UCASE = Alphabet.upper
-    CODING_LCASE = Alphabet.order
+    SIGNATURE = b"DAWG"
+    GADDAG_SIGNATURE = b"GDAG"
+    VERSION = 6
+    CODING = Alphabet.full_order + GADDAG_SEPARATOR
+    NO_SOURCE = b"\0" * 20
 
-    def __init__(self, stream):
+    def __init__(self, stream, signature = SIGNATURE, source_hash = NO_SOURCE):
         self._stream = stream
+        self._signature = signature
+        self._source_hash = source_hash
         self._byte_struct = struct.Struct("<B")
         self._loc_struct = struct.Struct("<L")
         # _locs is a dict of already written nodes and their stream locations
@@ -434,12 +525,28 @@ class _BinaryDawgPacker:
         # located
         self._fixups = dict()
 
-    def start(self, num_root_edges):
-        # The stream starts off with a single byte containing the
-        # number of root edges
-        self._stream.write(self._byte_struct.pack(num_root_edges))
-
-    def node_start(self, id, final, num_edges):
+    def start(self, num_nodes, num_root_edges, root_info):
+        # The stream starts off with the file header
+        self._stream.write(self._signature)
+        self._stream.write(self._byte_struct.pack(_BinaryDawgPacker.VERSION))
+        self._stream.write(self._loc_struct.pack(num_nodes))
+        # The length of the node data is filled in by finish()
+        self._length_pos = self._stream.tell()
+        self._stream.write(self._loc_struct.pack(0))
+        self._stream.write(self._source_hash)
+        self._data_pos = self._stream.tell()
+        # Then comes the header of the root node, which is never final
+        self._stream.write(self._byte_struct.pack(num_root_edges & 0x7F))
+        self._write_info(root_info)
+
+    def _write_info(self, info):
+        """ Write the letter bit pattern and completion lengths of a node """
+        mask, minlen, maxlen = info
+        self._stream.write(self._loc_struct.pack(mask))
+        self._stream.write(self._byte_struct.pack(minlen))
+        self._stream.write(self._byte_struct.pack(maxlen))
+
+    def node_start(self, id, final, num_edges, info):
         pos = self._stream.tell()
         if id in self._fixups:
             # We have previously output references to this node without
@@ -452,6 +559,7 @@ class _BinaryDawgPacker:
         # Remember where we put this node
         self._locs[id] = pos
         self._stream.write(self._byte_struct.pack((0x80 if final else 0x00) | (num_edges & 0x7F)))
+        self._write_info(info)
 
     def node_end(self, id):
         pass
@@ -465,10 +573,7 @@ class _BinaryDawgPacker:
             else:
                 if last is not None:
                     b.append(last)
-                try:
-                    last = _BinaryDawgPacker.CODING_LCASE.index(c)
-                except ValueError:
-                    last = _BinaryDawgPacker.CODING_UCASE.index(c)
+                last = _BinaryDawgPacker.CODING.index(c)
         b.append(last)
 
         if len(b) == 1:
@@ -493,6 +598,13 @@ class _BinaryDawgPacker:
             self._fixups[id].append(pos)
 
     def finish(self):
+        # Fill in the length of the node data in the file header, so that
+        # a truncated file can be detected when it is loaded
+        self._stream.seek(0, io.SEEK_END)
+        end = self._stream.tell()
+        self._stream.seek(self._length_pos)
+        self._stream.write(self._loc_struct.pack(end - self._data_pos))
+        self._stream.seek(end)
         # Clear the temporary fixup stuff from memory
         self._locs = dict()
         self._fixups = dict()
@@ -572,7 +684,7 @@ class DawgBuilder:
                 self._fin.close()
             self._fin = None
 
-    def _load(self, relpath, inputs, localeid, filter):
+    def _load(self, relpath, inputs, localeid, filter, gaddag = False):
         """ Load word lists into the DAWG from one or more static text files,
             assumed to be located in the relpath subdirectory.
             The text files should contain one word per line,
@@ -581,8 +693,13 @@ class DawgBuilder:
             All lower case is preferred. The words should appear in
             ascending sort order within each file. The input files will
             be merged in sorted order in the load process.
+            If gaddag is True, the GADDAG paths of the words are added
+            instead of the words themselves; see _add_gaddag().
         """
-        self._dawg = _Dawg()
+        # A GADDAG path is one character longer than its word
+        self._dawg = _Dawg(MAXLEN + 1 if gaddag else MAXLEN)
+        # The words to add as GADDAG paths, once they have all been read
+        words = [] if gaddag else None
         # Total number of words read from input files
         incount = 0
         # Total number of words written to output file
@@ -632,7 +749,10 @@ class DawgBuilder:
                     duplicates += 1
             elif (filter is None) or filter(word):
                 # This word passes the filter: add it to the graph
-                self._dawg.add_word(word)
+                if gaddag:
+                    words.append(word)
+                else:
+                    self._dawg.add_word(word)
                 lastword = word
                 outcount += 1
             if incount % 5000 == 0:
@@ -645,53 +765,100 @@ class DawgBuilder:
             assert not f.has_word()
             f.close()
             f = None
+        if gaddag:
+            self._add_gaddag(words)
         # Complete and clean up
         self._dawg.finish()
         print("Finished loading {0} words, output {1} words, {2} duplicates skipped".format(incount, outcount, duplicates))
 
-    def _output_binary(self, relpath, output):
-        """ Write the DAWG to a flattened binary output file with extension '.dawg' """
+    def _add_gaddag(self, words):
+        """ Add the GADDAG paths of a list of words to the graph. The paths are
+            reversed prefixes followed by a separator and suffixes, and need to be
+            added in sorted order, which is unrelated to the order of the words.
+            They are therefore generated and sorted in partitions by their first
+            letter, so that only a fraction of them is held in memory at a time. """
+        order = _DawgNode._EDGE_ORDER
+        sep = GADDAG_SEPARATOR
+        # Sort the paths by the same letter order as the edges, with the separator last
+        key = lambda path: [order.get(c, len(order)) for c in path]
+        letters = sorted(set(c for word in words for c in word), key = key)
+        num_paths = 0
+        for letter in letters:
+            paths = []
+            for word in words:
+                # Find each split of the word where the prefix ends with the letter
+                i = word.find(letter)
+                while i >= 0:
+                    prefix = word[i::-1]
+                    suffix = word[i + 1:]
+                    # No separator if the suffix is empty
+                    paths.append(prefix + sep + suffix if suffix else prefix)
+                    i = word.find(letter, i + 1)
+            paths.sort(key = key)
+            for path in paths:
+                self._dawg.add_word(path)
+            num_paths += len(paths)
+        print("Added {0} GADDAG paths for {1} words".format(num_paths, len(words)))
+
+    def _output_binary(self, relpath, output, gaddag = False):
+        """ Write the DAWG to a flattened binary output file with extension '.dawg',
+            or a GADDAG to a file with extension '.gaddag'. The text file is
+            written first, and its hash is stored in the header of the binary
+            file, so that DawgDictionary can tell whether the two match. """
         assert self._dawg is not None
-        # !!! Experimental / debugging...
+        source_hash = DawgDictionary.source_hash(os.path.abspath(os.path.join(relpath,
+            output + (u".text.gaddag" if gaddag else u".text.dawg"))))
         f = io.BytesIO()
         # Create a packer to flatten the tree onto a binary stream
-        p = _BinaryDawgPacker(f)
+        p = _BinaryDawgPacker(f, _BinaryDawgPacker.GADDAG_SIGNATURE if gaddag
+            else _BinaryDawgPacker.SIGNATURE, source_hash)
         # Write the tree using the packer
         self._dawg.write_packed(p)
-        # Dump the packer contents to stdout for debugging
-        p.dump()
-        # Write packed DAWG to binary file
-        with open(os.path.abspath(os.path.join(relpath, output + u".dawg")), "wb") as of:
+        # Write packed DAWG to binary file. Write to a temporary file first and then
+        # rename it, since running processes may have the old file memory-mapped
+        # and would crash if it were truncated and overwritten in place.
+        fname = os.path.abspath(os.path.join(relpath, output + (u".gaddag" if gaddag else u".dawg")))
+        tname = fname + u".tmp"
+        with open(tname, "wb") as of:
             of.write(f.getvalue())
         f.close()
-
-    def _output_text(self, relpath, output):
-        """ Write the DAWG to a text output file with extension '.text.dawg' """
+        if os.path.exists(fname) and os.name == "nt":
+            # Windows does not allow renaming over an existing file
+            os.remove(fname)
+        os.rename(tname, fname)
+
+    def _output_text(self, relpath, output, gaddag = False):
+        """ Write the DAWG to a text output file with extension '.text.dawg',
+            or a GADDAG to a file with extension '.text.gaddag' """
         assert self._dawg is not None
-        fname = os.path.abspath(os.path.join(relpath, output + u".text.dawg"))
+        fname = os.path.abspath(os.path.join(relpath,
+            output + (u".text.gaddag" if gaddag else u".text.dawg")))
         with codecs.open(fname, mode='w', encoding='utf-8') as fout:
             self._dawg.write_text(fout)
 
-    def build(self, inputs, output, relpath="resources", localeid=None, filter=None):
+    def build(self, inputs, output, relpath="resources", localeid=None, filter=None, gaddag=False):
         """ Build a DAWG from input file(s) and write it to the output file(s) (potentially in multiple formats).
             The input files are assumed to be individually sorted in correct ascending alphabetical
             order. They will be merged in parallel into a single sorted stream and added to the DAWG.
+            If gaddag is True, a GADDAG of the words is built instead of a DAWG.
         """
         # inputs is a list of input file names
         # output is an output file name without file type suffix (extension);
-        # ".dawg" and ".text.dawg" will be appended depending on output formats
+        # ".dawg" and ".text.dawg" will be appended depending on output formats,
+        # or ".gaddag" and ".text.gaddag" for a GADDAG
         # relpath is a relative path to the input and output files
         print("DawgBuilder starting...")
         if (not inputs) or (not output):
             # Nothing to do
             print("No inputs or no output: Nothing to do")
             return
-        self._load(relpath, inputs, localeid, filter)
+        self._load(relpath, inputs, localeid, filter, gaddag)
         # print("Dumping...")
         # self._dawg.dump()
         print("Outputting...")
-        # self._output_binary(relpath, output) # Not used for now
-        self._output_text(relpath, output)
+        # The binary file records the hash of the text file, which is thus written first
+        self._output_text(relpath, output, gaddag)
+        self._output_binary(relpath, output, gaddag)
         print("DawgBuilder done")
 
 # Filter functions
@@ -793,16 +960,35 @@ def run_skrafl():
     dawg = DawgDictionary()
     fpath = os.path.abspath(os.path.join("resources", "ordalisti.text.dawg"))
     t0 = time.time()
-    dawg.load(fpath)
+    dawg.load_compact(fpath)
     t1 = time.time()
 
     print("DAWG loaded in {0:.2f} seconds".format(t1 - t0))
 
+    # Store a snapshot of the new graph, as Wordbase would upon its first load
     t0 = time.time()
-    dawg.store_pickle(os.path.abspath(os.path.join("resources", "ordalisti.dawg.pickle")))
+    dawg.store_snapshot(os.path.abspath(os.path.join("resources", "ordalisti.dawg.snapshot")),
+        DawgDictionary.source_hash(fpath))
     t1 = time.time()
 
-    print("DAWG pickle file stored in {0:.2f} seconds".format(t1 - t0))
+    print("DAWG snapshot file stored in {0:.2f} seconds".format(t1 - t0))
+
+def run_skrafl_gaddag():
+    """ Build a GADDAG from the same word list as run_skrafl() """
+    # The GADDAG is used for move generation on the board; it has about as
+    # many paths as the word list has letters, so the build takes a while
+    print(u"Starting GADDAG build for skraflhjalp/netskrafl.appspot.com")
+    db = DawgBuilder()
+    t0 = time.time()
+    db.build(
+        ["ordalistimax15.sorted.txt"], # Input files to be merged
+        "ordalisti", # Output file - full name will be ordalisti.text.gaddag
+        "resources", # Subfolder of input and output files
+        "isl", # Identifier of locale to use for sorting order
+        filter_skrafl, # Word filter function to apply
+        gaddag = True)
+    t1 = time.time()
+    print("Build took {0:.2f} seconds".format(t1 - t0))
 
 
 if __name__ == '__main__':
@@ -11,16 +11,44 @@
     The graph is pre-built using the code in dawgbuilder.py and stored
     in a text-based file to be loaded at run-time by DawgDictionary.
 
+    The graph can also be stored in a packed binary file ('.dawg'), which
+    DawgDictionary.load_binary() memory-maps and navigates directly from the
+    buffer using node offsets. This requires no parsing at load time, and
+    all processes that map the same file share the same physical memory pages.
+    Its header holds the length of the node data, so that a truncated file is
+    rejected, and a hash of the text file that was written along with it.
+
+    DawgDictionary.load_compact() loads the text file into a small number of flat
+    arrays instead of a graph of node objects, which takes a fraction of the memory.
+    Such a graph can be stored in a snapshot file (store_snapshot()), with a header
+    holding a format version, a hash of the source text file, node and edge counts,
+    the alphabet and a checksum, and loaded with a few bulk reads (load_snapshot()).
+
+    GaddagDictionary is a variant that loads a GADDAG built by dawgbuilder.py in any of
+    the above formats, and generates moves on a line of the board by growing words
+    outwards from anchor squares, in both directions (GaddagDictionary.find_placements()).
+
+    DawgDictionary.share() moves a compact graph into an anonymous shared memory
+    mapping in the packed format, so that the worker processes of a pre-forking
+    server can share a single copy of the graph loaded by the master process.
+
     The main class supports three fundamental query functions:
 
     DawgDictionary.find(word)
         Returns True if the word is found in the dictionary, or False if not.
         The __contains__ operator is supported, so "'myword' in dawgdict" also works.
 
+    DawgDictionary.find_many(words)
+        Returns a list of booleans, one for each word in the given batch, in a single
+        traversal of the graph that shares the common prefixes of the sorted words.
+
     DawgDictionary.find_matches(pattern)
         Returns a list of words that match the pattern. The pattern can contain
         wildcards ('?'). For example, result = dawgdict.find_matches("ex???") returns
-        a list of all 5-letter words starting with "ex".
+        a list of all 5-letter words starting with "ex". The pattern can also contain
+        letter sets ('[aeiou]', '[^aeiou]'), '*' for any sequence of letters, anchors
+        ('^ex' for words starting with "ex") and length limits ('{5,8}'), in which case
+        it is compiled into an automaton that is run in step with the graph traversal.
 
     DawgDictionary.find_permutations(rack)
         Returns a list of all permutations of the given rack, i.e. valid words
@@ -29,6 +57,24 @@
         returns a list of all words from 1 to 3 characters that can be constructed from
         the letters "s" and "e" and any one additional letter.
 
+    DawgDictionary.find_placements(template, rack)
+        Returns a list of (start, word, blanks) tuples for all words that can be placed
+        on a line of the board, given as a template of the tiles already on it ('.' for
+        an empty square), by filling empty squares with tiles from the rack.
+        For example, dawgdict.find_placements("..a...", "bkr?") finds words that
+        use the 'a' on the board as well as words placed before or after it.
+        Anchor squares that the words must cover, and cross-checks that limit the
+        letters on each square to those forming valid cross words, can be given.
+        skraflboard.py uses it to generate all moves on a full board.
+
+    DawgDictionary.iter_matches(pattern, limit) and DawgDictionary.iter_permutations(rack, ...)
+        Streaming variants of the above, which generate words as the graph is traversed
+        and stop the traversal as soon as the consumer stops iterating.
+
+    DawgDictionary.page_matches(pattern, count, token) and DawgDictionary.page_permutations(rack, count, token)
+        Paginated variants, which return a page of words and an opaque continuation token
+        that a subsequent call uses to resume the navigation where the page ended.
+
     All of the above query functions are built on top of a generic DAWG navigation function:
 
     DawgDictionary.navigate(navigator)
@@ -36,15 +82,38 @@
         results. The navigation object should implement a number of interface functions,
         as documented in comments for the navigate() function.
 
+    Budget(nodes, seconds)
+        Limits the number of graph nodes visited and/or the time spent by a navigation.
+        It can be passed to navigate() and the query functions, which then return
+        a partial result if it runs out, as flagged by budget.exhausted().
+
     DawgDictionary.FindNavigator(word)
         A navigation class to find words by exact match. Used by DawgDictionary.find()
 
     DawgDictionary.PermutationNavigator(rack, minlen)
         A navigation class to find rack permutations. Used by DawgDictionary.find_permutations()
 
+    DawgDictionary.CombinationNavigator(rack, minlen)
+        A navigation class to find rack permutations and combinations with one additional letter
+        in a single traversal. Used by DawgDictionary.find_combinations()
+
+    DawgDictionary.PlacementNavigator(template, rack, minlen, checks)
+        A navigation class to find words that fit a line template, starting at its
+        first square, with the rack filling the empty squares. Used by
+        DawgDictionary.find_placements()
+
+    DawgDictionary.GaddagNavigator(template, rack, anchor, leftmost, minlen, checks)
+        A navigation class to find words that cover an anchor square on a line of the board,
+        growing them leftwards and then rightwards from it through a GADDAG.
+        Used by GaddagDictionary.find_placements()
+
     DawgDictionary.MatchNavigator(rack, minlen)
         A navigation class to find words matching a pattern. Used by DawgDictionary.find_matches()
 
+    DawgDictionary.PatternNavigator(pattern)
+        A navigation class to find words matching a pattern in the extended pattern language.
+        Used by DawgDictionary.find_matches() for such patterns
+
     See also comments in dawgbuilder.py
 
     Test code for this module is found in dawgtester.py
@@ -52,12 +121,27 @@
 """
 
 import os
+import sys
 import codecs
 import threading
 import logging
 import time
+import struct
+import itertools
+import hashlib
+import zlib
+import base64
 import cPickle as pickle
 
+from array import array
+from collections import OrderedDict
+
+try:
+    import mmap
+except ImportError:
+    # Memory mapping is not available in all environments
+    mmap = None
+
 from languages import Alphabet
 
 
@@ -68,13 +152,559 @@ class _Node:
     def __init__(self):
         self.final = False
         self.edges = dict()
+        # Lookup of outgoing edges by the first letter of their prefix, and
+        # a list of the (prefix, nextnode) tuples of the edges in alphabetical
+        # order; filled in by index_edges() once the node is fully loaded
+        self.first_edges = None
+        self.edge_list = None
+        # Bit pattern of the letters that occur on any path from this node,
+        # and the lengths of the shortest and longest word completions from it;
+        # calculated by DawgDictionary once the graph is fully loaded
+        self.mask = None
+        self.minlen = 0
+        self.maxlen = 0
+
+    def index_edges(self):
+        """ Build the lookup of edges by first letter and the sorted edge list """
+        self.first_edges = dict((prefix[0], (prefix, nextnode))
+            for prefix, nextnode in self.edges.items())
+        self.edge_list = sorted(self.edges.items(), key = _edge_order)
+
+    def edge(self, firstchar):
+        """ Return the (prefix, nextnode) tuple of the edge starting
+            with the given letter, or None if there is no such edge """
+        return self.first_edges.get(firstchar)
+
+    def matching_edges(self, letters):
+        """ Return a list of the (prefix, nextnode) tuples of the edges
+            starting with any of the given distinct letters """
+        first_edges = self.first_edges
+        if len(letters) < len(first_edges):
+            # Look up each letter
+            return [first_edges[c] for c in letters if c in first_edges]
+        # Fewer edges than letters: check each edge
+        return [edge for edge in self.edge_list if edge[0][0] in letters]
+
+
+if sys.version_info >= (3, 0):
+    def _byte_at(buf, ix):
+        """ Return the byte at the given index in a buffer, as an integer """
+        return buf[ix]
+else:
+    def _byte_at(buf, ix):
+        """ Return the byte at the given index in a buffer, as an integer """
+        return ord(buf[ix])
+
+
+# Coding of letters as indices into the alphabet
+_LETTER_CODE = dict((c, i) for i, c in enumerate(Alphabet.full_order))
+# Bit of each coded letter, as in Alphabet.bit, or 0 for letters that have no bit,
+# with an extra zero for the GADDAG separator
+_LETTER_BITS = [Alphabet.letter_bit.get(c, 0) for c in Alphabet.full_order] + [0]
+# Tile score of each coded letter, with an extra zero for letters outside the alphabet
+_LETTER_SCORES = [Alphabet.scores.get(c, 0) for c in Alphabet.full_order] + [0]
+
+
+# The separator between the reversed prefix and the suffix of a word
+# on a path through a GADDAG; see GaddagDictionary
+GADDAG_SEPARATOR = u'+'
+# Coding of edge letters in packed and compact graphs: the alphabet,
+# followed by the GADDAG separator
+_EDGE_CODING = Alphabet.full_order + GADDAG_SEPARATOR
+_EDGE_CODE = dict((c, i) for i, c in enumerate(_EDGE_CODING))
+
+
+def _edge_order(edge):
+    """ Sort key that puts (prefix, nextnode) edge tuples in alphabetical order.
+        Since no two edges out of a node start with the same letter, the first
+        letter of the prefix suffices. """
+    return _EDGE_CODE.get(edge[0][0], len(_EDGE_CODE))
+
+
+def _template_squares(template):
+    """ Return a list of the squares of a board line template, with the letter
+        on each square, or None for an empty square ('.') """
+    squares = []
+    for c in template:
+        if c == u'.':
+            squares.append(None)
+        elif c in _LETTER_CODE:
+            squares.append(c)
+        else:
+            raise ValueError(u"Invalid character '{0}' in template '{1}'".format(c, template))
+    return squares
+
+
+def _anchor_list(squares, anchors):
+    """ Return a sorted list of anchor squares for a board line, checking that
+        they are empty. If anchors is None, all empty squares are anchors. """
+    if anchors is None:
+        return [i for i, square in enumerate(squares) if square is None]
+    anchors = sorted(set(anchors))
+    for a in anchors:
+        if not 0 <= a < len(squares) or squares[a] is not None:
+            raise ValueError(u"Anchor {0} is not an empty square".format(a))
+    return anchors
+
+
+def _check_list(squares, checks):
+    """ Return a list of the cross-checks for the squares of a board line, each
+        a bit pattern as in Alphabet.bit of the letters that may be placed on
+        an empty square, or None if any letter may be placed there """
+    if checks is None:
+        return [None] * len(squares)
+    if len(checks) != len(squares):
+        raise ValueError(u"Expected {0} cross-checks, got {1}".format(len(squares), len(checks)))
+    return list(checks)
+
+
+# Strings of the letters allowed by cross-checks, by bit pattern
+_CHECK_LETTERS = dict()
+
+
+def _check_letters(check):
+    """ Return a string of the letters allowed by a cross-check, or None
+        if all letters are allowed """
+    if check is None:
+        return None
+    letters = _CHECK_LETTERS.get(check)
+    if letters is None:
+        letters = u''.join(c for ix, c in enumerate(Alphabet.full_order) if _LETTER_BITS[ix] & check)
+        _CHECK_LETTERS[check] = letters
+    return letters
+
+
+def _longest_first(result, length):
+    """ Return the words of an alphabetically sorted result list grouped by length,
+        longest first, while remaining in alphabetical order within each length.
+        This is a single pass through the list instead of a sort. """
+    if not result:
+        return result
+    groups = [[] for _ in range(max(length(w) for w in result) + 1)]
+    for w in result:
+        groups[length(w)].append(w)
+    return list(itertools.chain.from_iterable(reversed(groups)))
+
+
+class _PackedNode(object):
+
+    """ A lightweight view of a node within a packed (binary) DAWG buffer.
+        The node is decoded directly from the buffer upon access; see
+        _BinaryDawgPacker in dawgbuilder.py for a description of the format.
+    """
+
+    __slots__ = ('_buf', '_offset')
+
+    _loc_struct = struct.Struct("<L")
+
+    # A node header byte followed by a letter bit pattern
+    # and the shortest and longest completion lengths
+    _HEADER_SIZE = 1 + 4 + 1 + 1
+
+    def __init__(self, buf, offset):
+        self._buf = buf
+        self._offset = offset
+
+    @property
+    def final(self):
+        """ True if a valid word ends at this node """
+        return bool(_byte_at(self._buf, self._offset) & 0x80)
+
+    @property
+    def mask(self):
+        """ Bit pattern of the letters that occur on any path from this node """
+        return _PackedNode._loc_struct.unpack_from(self._buf, self._offset + 1)[0]
+
+    @property
+    def minlen(self):
+        """ Length of the shortest word completion from this node """
+        return _byte_at(self._buf, self._offset + 5)
+
+    @property
+    def maxlen(self):
+        """ Length of the longest word completion from this node """
+        return _byte_at(self._buf, self._offset + 6)
+
+    def _decode_edge(self, ix):
+        """ Decode the edge at the given buffer index, returning
+            its prefix, its next node and the index of the following edge """
+        buf = self._buf
+        coding = _EDGE_CODING
+        hdr = _byte_at(buf, ix)
+        ix += 1
+        if hdr & 0x40:
+            # Single-letter prefix
+            prefix = coding[hdr & 0x3F]
+        else:
+            # Multi-letter prefix: the header contains the letter count
+            lenp = hdr & 0x3F
+            chars = []
+            for j in range(ix, ix + lenp):
+                c = _byte_at(buf, j)
+                chars.append(coding[c & 0x7F])
+                if c & 0x80:
+                    # Vertical bar denotes finality of the previous letter
+                    chars.append(u'|')
+            prefix = u''.join(chars)
+            ix += lenp
+        loc = _PackedNode._loc_struct.unpack_from(buf, ix)[0]
+        return prefix, (None if loc == 0 else _PackedNode(buf, loc)), ix + 4
+
+    @property
+    def edge_list(self):
+        """ Decode the outgoing edges of this node into a list of (prefix, nextnode)
+            tuples, in alphabetical order as they are stored in the buffer """
+        ix = self._offset
+        num_edges = _byte_at(self._buf, ix) & 0x7F
+        ix += _PackedNode._HEADER_SIZE
+        edges = []
+        for _ in range(num_edges):
+            prefix, nextnode, ix = self._decode_edge(ix)
+            edges.append((prefix, nextnode))
+        return edges
+
+    @property
+    def edges(self):
+        """ Decode the outgoing edges of this node into a dict of prefix -> node """
+        return dict(self.edge_list)
+
+    def edge(self, firstchar):
+        """ Return the (prefix, nextnode) tuple of the edge starting
+            with the given letter, or None if there is no such edge """
+        code = _EDGE_CODE.get(firstchar)
+        if code is None:
+            return None
+        buf = self._buf
+        ix = self._offset
+        num_edges = _byte_at(buf, ix) & 0x7F
+        ix += _PackedNode._HEADER_SIZE
+        for _ in range(num_edges):
+            hdr = _byte_at(buf, ix)
+            if hdr & 0x40:
+                first = hdr & 0x3F
+                size = 1 + 4
+            else:
+                first = _byte_at(buf, ix + 1) & 0x7F
+                size = 1 + (hdr & 0x3F) + 4
+            if first == code:
+                prefix, nextnode, _ = self._decode_edge(ix)
+                return prefix, nextnode
+            # Skip to the next edge
+            ix += size
+        return None
+
+    def matching_edges(self, letters):
+        """ Return a list of the (prefix, nextnode) tuples of the edges
+            starting with any of the given distinct letters """
+        buf = self._buf
+        coding = _EDGE_CODING
+        ix = self._offset
+        num_edges = _byte_at(buf, ix) & 0x7F
+        ix += _PackedNode._HEADER_SIZE
+        result = []
+        for _ in range(num_edges):
+            hdr = _byte_at(buf, ix)
+            if hdr & 0x40:
+                first = hdr & 0x3F
+                size = 1 + 4
+            else:
+                first = _byte_at(buf, ix + 1) & 0x7F
+                size = 1 + (hdr & 0x3F) + 4
+            if coding[first] in letters:
+                prefix, nextnode, _ = self._decode_edge(ix)
+                result.append((prefix, nextnode))
+            ix += size
+        return result
+
+
+class _CompactNode(object):
+
+    """ A lightweight view of a node within a _CompactGraph """
+
+    __slots__ = ('_graph', '_ix')
+
+    def __init__(self, graph, ix):
+        self._graph = graph
+        self._ix = ix
+
+    @property
+    def final(self):
+        """ True if a valid word ends at this node """
+        return bool(self._graph.flags[self._ix] & _CompactGraph.FINAL)
+
+    @property
+    def mask(self):
+        """ Bit pattern of the letters that occur on any path from this node """
+        return self._graph.masks[self._ix]
+
+    @property
+    def minlen(self):
+        """ Length of the shortest word completion from this node """
+        return self._graph.minlens[self._ix]
+
+    @property
+    def maxlen(self):
+        """ Length of the longest word completion from this node """
+        return self._graph.maxlens[self._ix]
+
+    def _decode_edge(self, e):
+        """ Decode edge e, returning its prefix and its next node """
+        g = self._graph
+        labels = g.labels
+        coding = _EDGE_CODING
+        chars = []
+        for j in range(g.label_first[e], g.label_first[e + 1]):
+            c = labels[j]
+            chars.append(coding[c & 0x7F])
+            if c & 0x80:
+                # Vertical bar denotes finality of the previous letter
+                chars.append(u'|')
+        child = g.child[e]
+        return u''.join(chars), (None if child == 0 else _CompactNode(g, child))
+
+    @property
+    def edge_list(self):
+        """ Decode the outgoing edges of this node into a list of (prefix, nextnode)
+            tuples, in alphabetical order as they are stored in the graph """
+        g = self._graph
+        return [self._decode_edge(e)
+            for e in range(g.edge_first[self._ix], g.edge_first[self._ix + 1])]
+
+    @property
+    def edges(self):
+        """ Decode the outgoing edges of this node into a dict of prefix -> node """
+        return dict(self.edge_list)
+
+    def edge(self, firstchar):
+        """ Return the (prefix, nextnode) tuple of the edge starting
+            with the given letter, or None if there is no such edge """
+        code = _EDGE_CODE.get(firstchar)
+        if code is None:
+            return None
+        g = self._graph
+        labels = g.labels
+        label_first = g.label_first
+        for e in range(g.edge_first[self._ix], g.edge_first[self._ix + 1]):
+            if labels[label_first[e]] & 0x7F == code:
+                return self._decode_edge(e)
+        return None
+
+    def matching_edges(self, letters):
+        """ Return a list of the (prefix, nextnode) tuples of the edges
+            starting with any of the given distinct letters """
+        g = self._graph
+        labels = g.labels
+        label_first = g.label_first
+        coding = _EDGE_CODING
+        return [self._decode_edge(e)
+            for e in range(g.edge_first[self._ix], g.edge_first[self._ix + 1])
+            if coding[labels[label_first[e]] & 0x7F] in letters]
+
+
+class _CompactGraph:
+
+    """ An array-backed representation of a DAWG, as an alternative to
+        a graph of _Node objects with their own edge dicts.
+
+        Nodes are identified by their index, with the root at index 0.
+        The outgoing edges of node i are numbered from edge_first[i] up to
+        (but not including) edge_first[i + 1]. The letters of edge e are
+        labels[label_first[e]] up to labels[label_first[e + 1]], coded as
+        indices into Alphabet.full_order followed by GADDAG_SEPARATOR, with
+        the high bit set if the letter completes a valid word within the edge.
+        Edge e leads to node child[e],
+        where 0 means None since the root is never a child. masks[i] is
+        a bit pattern of the letters that occur on any path from node i,
+        and minlens[i] and maxlens[i] are the lengths of the shortest and
+        longest word completions from it. The edges of each node are kept
+        in alphabetical order of their first letter, whatever their order
+        in the text file.
+    """
+
+    # Node flag bits
+    FINAL = 0x01
+
+    def __init__(self):
+        self.flags = array('B')
+        self.edge_first = array('I')
+        self.label_first = array('I')
+        self.labels = array('B')
+        self.child = array('I')
+        self.masks = array('I')
+        self.minlens = array('B')
+        self.maxlens = array('B')
+
+    def add_node(self, line):
+        """ Parse a single line of a DAWG text file and add it as the next node """
+        edgedata = line.split(u'_')
+        firstedge = 0
+        flags = 0
+        if edgedata[0] == u'|':
+            # Vertical bar denotes final node
+            flags |= _CompactGraph.FINAL
+            firstedge = 1
+        self.flags.append(flags)
+        self.edge_first.append(len(self.child))
+        code = _EDGE_CODE
+        labels = self.labels
+        edges = [edge.split(u':') for edge in edgedata[firstedge:]]
+        edges.sort(key = _edge_order)
+        for prefix, edgeid in edges:
+            self.label_first.append(len(labels))
+            for c in prefix:
+                if c == u'|':
+                    labels[-1] |= 0x80
+                else:
+                    labels.append(code[c])
+            # Node ids in the text file are line numbers, with 0 for None
+            # and 2 for the first node after the root, which is in line 1
+            edgeid = int(edgeid)
+            self.child.append(0 if edgeid == 0 else edgeid - 1)
+
+    def finish(self):
+        """ Add sentinels at the end of the edge and label arrays,
+            and calculate the letter bit patterns of the nodes """
+        self.edge_first.append(len(self.child))
+        self.label_first.append(len(self.labels))
+        info = [None] * len(self.flags)
+        for ix in range(len(info)):
+            self._calc_info(ix, info)
+        self.masks = array('I', [i[0] for i in info])
+        self.minlens = array('B', [i[1] for i in info])
+        self.maxlens = array('B', [i[2] for i in info])
+
+    def _calc_info(self, ix, info):
+        """ Calculate the letter bit pattern and the shortest and longest
+            completion lengths of node ix, memoizing results in info """
+        if info[ix] is None:
+            bits = _LETTER_BITS
+            labels = self.labels
+            mask = 0
+            minlen = None
+            maxlen = 0
+            for e in range(self.edge_first[ix], self.edge_first[ix + 1]):
+                first = self.label_first[e]
+                lenp = self.label_first[e + 1] - first
+                completion = None
+                for j in range(first, first + lenp):
+                    mask |= bits[labels[j] & 0x7F]
+                    if completion is None and labels[j] & 0x80:
+                        # A word is completed within the edge
+                        completion = j - first + 1
+                child = self.child[e]
+                if child:
+                    child_mask, child_minlen, child_maxlen = self._calc_info(child, info)
+                    mask |= child_mask
+                    maxlen = max(maxlen, lenp + child_maxlen)
+                    if completion is None:
+                        completion = lenp if self.flags[child] & _CompactGraph.FINAL else lenp + child_minlen
+                else:
+                    maxlen = max(maxlen, lenp)
+                    if completion is None:
+                        completion = lenp
+                minlen = completion if minlen is None else min(minlen, completion)
+            info[ix] = (mask, minlen or 0, maxlen)
+        return info[ix]
+
+    def num_nodes(self):
+        """ Return the number of nodes in the graph, including the root """
+        return len(self.flags)
+
+    def root(self):
+        """ Return a view of the root node """
+        return _CompactNode(self, 0) if self.flags else None
+
+    def arrays(self):
+        """ Return the graph arrays, in the order in which they are stored in a snapshot """
+        return (self.flags, self.edge_first, self.label_first, self.labels, self.child,
+            self.masks, self.minlens, self.maxlens)
+
+    def memory_size(self):
+        """ Return the number of bytes occupied by the graph arrays """
+        return sum(a.itemsize * len(a) for a in self.arrays())
+
+    def pack(self):
+        """ Return the graph as a bytearray in the packed binary format written by
+            _BinaryDawgPacker in dawgbuilder.py, with the nodes in index order """
+        edge_first = self.edge_first
+        label_first = self.label_first
+        labels = self.labels
+        child = self.child
+        num_nodes = len(self.flags)
+        hsize = DawgDictionary._header_struct.size
+        # First pass: calculate the offset of each node within the buffer
+        offsets = [0] * num_nodes
+        pos = hsize
+        for ix in range(num_nodes):
+            offsets[ix] = pos
+            pos += _PackedNode._HEADER_SIZE
+            for e in range(edge_first[ix], edge_first[ix + 1]):
+                lenp = label_first[e + 1] - label_first[e]
+                # Prefix header, letters of multi-letter prefixes, child offset
+                pos += 1 + (lenp if lenp > 1 else 0) + 4
+        # Second pass: fill in the buffer
+        buf = bytearray(pos)
+        DawgDictionary._header_struct.pack_into(buf, 0,
+            DawgDictionary._SIGNATURE, DawgDictionary._VERSION, num_nodes - 1,
+            pos - hsize, DawgDictionary._NO_SOURCE)
+        info_struct = struct.Struct("<LBB")
+        loc_struct = _PackedNode._loc_struct
+        for ix in range(num_nodes):
+            pos = offsets[ix]
+            first = edge_first[ix]
+            last = edge_first[ix + 1]
+            buf[pos] = (0x80 if self.flags[ix] & _CompactGraph.FINAL else 0x00) | ((last - first) & 0x7F)
+            info_struct.pack_into(buf, pos + 1, self.masks[ix], self.minlens[ix], self.maxlens[ix])
+            pos += _PackedNode._HEADER_SIZE
+            for e in range(first, last):
+                lfirst = label_first[e]
+                lenp = label_first[e + 1] - lfirst
+                if lenp == 1:
+                    # Single-letter prefix, with its final bit
+                    buf[pos] = labels[lfirst] | 0x40
+                    pos += 1
+                else:
+                    buf[pos] = lenp & 0x3F
+                    buf[pos + 1:pos + 1 + lenp] = labels[lfirst:lfirst + lenp].tostring()
+                    pos += 1 + lenp
+                c = child[e]
+                loc_struct.pack_into(buf, pos, offsets[c] if c else 0)
+                pos += 4
+        return buf
+
 
 class DawgDictionary:
 
+    # Header of a packed binary DAWG file; see _BinaryDawgPacker in dawgbuilder.py
+    _SIGNATURE = b"DAWG"
+    _VERSION = 6
+    _header_struct = struct.Struct("<4sBLL20s")
+    # Source hash of a packed graph that was not written along with a text file
+    _NO_SOURCE = b"\0" * 20
+
+    # Header of a snapshot file, containing the arrays of a compact graph:
+    # signature, format version, byte order (0 = little endian) and item size
+    # of the 'I' arrays, SHA-1 hash of the source text file, node, edge and label
+    # counts, CRC-32 checksum of the array data, and the length in bytes of the
+    # UTF-8 encoded alphabet that follows the header
+    _SNAPSHOT_SIGNATURE = b"DSNP"
+    _SNAPSHOT_VERSION = 2
+    _snapshot_struct = struct.Struct("<4sBBB20sLLLLH")
+    # The alphabet stored in snapshot headers, which must match when loading
+    _ALPHABET = Alphabet.full_order
+
     def __init__(self):
         # Initialize an empty graph
         # The root entry will eventually be self._nodes[0]
         self._nodes = None
+        # The root node of the graph, from whichever source it was loaded
+        self._root = None
+        # Number of nodes in the graph, including the root
+        self._num_nodes = 0
+        # Memory-mapped buffer, if the graph was loaded from a packed binary file
+        self._buf = None
+        # Array-backed graph, if the graph was loaded by load_compact()
+        self._compact = None
         # Running counter of nodes read
         self._index = 1
         # Lock to ensure that only one thread loads the dictionary
@@ -119,12 +749,50 @@ class DawgDictionary:
                 newnode.edges[prefix] = newterminal
                 self._nodes[edgeid] = newterminal
 
+    def _index_edges(self):
+        """ Build the first-letter edge lookup and calculate the
+            letter bit pattern of every node in the graph """
+        for node in self._nodes.values():
+            node.index_edges()
+        for node in self._nodes.values():
+            self._calc_info(node)
+
+    def _calc_info(self, node):
+        """ Calculate the bit pattern of the letters that occur on any path from
+            the node, and the lengths of the shortest and longest word completions """
+        if node.mask is None:
+            mask = 0
+            minlen = None
+            maxlen = 0
+            for prefix, nextnode in node.edges.items():
+                mask |= Alphabet.letter_mask(prefix)
+                lenp = len(prefix) - prefix.count(u'|')
+                if nextnode is not None:
+                    self._calc_info(nextnode)
+                    mask |= nextnode.mask
+                    maxlen = max(maxlen, lenp + nextnode.maxlen)
+                else:
+                    maxlen = max(maxlen, lenp)
+                if u'|' in prefix:
+                    # A word is completed within the prefix
+                    completion = prefix.index(u'|')
+                elif nextnode is None or nextnode.final:
+                    # A word is completed at the end of the prefix
+                    completion = lenp
+                else:
+                    completion = lenp + nextnode.minlen
+                minlen = completion if minlen is None else min(minlen, completion)
+            node.mask = mask
+            node.minlen = minlen or 0
+            node.maxlen = maxlen
+        return node.mask
+
     def load(self, fname):
         """ Load a DAWG from a text file """
         # Reset the graph contents
         with self._lock:
             # Ensure that we don't have multiple threads trying to load simultaneously
-            if self._nodes is not None:
+            if self._root is not None:
                 # Already loaded
                 return
             self._nodes = dict()
@@ -139,6 +807,26 @@ class DawgDictionary:
                         line = line[0:-1]
                     if line:
                         self._parse_and_add(line)
+            self._index_edges()
+            self._num_nodes = len(self._nodes)
+            self._root = self._nodes.get(0)
+
+    def load_compact(self, fname):
+        """ Load a DAWG from a text file into a compact, array-backed graph """
+        with self._lock:
+            if self._root is not None:
+                # Already loaded
+                return
+            graph = _CompactGraph()
+            with codecs.open(fname, mode='r', encoding='utf-8') as fin:
+                for line in fin:
+                    line = line.rstrip(u'\r\n')
+                    if line:
+                        graph.add_node(line)
+            graph.finish()
+            self._compact = graph
+            self._num_nodes = graph.num_nodes()
+            self._root = graph.root()
 
     def store_pickle(self, fname):
         """ Store a DAWG in a Python pickle file """
@@ -148,15 +836,195 @@ class DawgDictionary:
     def load_pickle(self, fname):
         """ Load a DAWG from a Python pickle file """
         with self._lock:
-            if self._nodes is not None:
+            if self._root is not None:
                 # Already loaded
                 return
             with open(fname, "rb") as pf:
                 self._nodes = pickle.load(pf)
+            root = self._nodes.get(0)
+            if getattr(root, "mask", None) is None or getattr(root, "edge_list", None) is None:
+                # Pickle from a previous version, without edge lookups, sorted edges or bit patterns
+                for node in self._nodes.values():
+                    node.mask = None
+                self._index_edges()
+            self._num_nodes = len(self._nodes)
+            self._root = self._nodes.get(0)
+
+    def load_binary(self, fname, source_hash = None):
+        """ Load a DAWG from a packed binary file by memory-mapping it.
+            The nodes are navigated in place, so no parsing is required.
+            If source_hash is given, it must match the hash of the text file
+            that is stored in the header, as written by dawgbuilder.py. """
+        if mmap is None:
+            raise ValueError("Memory mapping is not supported in this environment")
+        with self._lock:
+            if self._root is not None:
+                # Already loaded
+                return
+            with open(fname, "rb") as f:
+                # The mapping remains valid after the file is closed
+                buf = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            hsize = DawgDictionary._header_struct.size
+            if len(buf) <= hsize:
+                buf.close()
+                raise ValueError("File {0} is too short to contain a DAWG".format(fname))
+            sig, version, num_nodes, length, source = DawgDictionary._header_struct.unpack_from(buf, 0)
+            if sig != self._SIGNATURE or version != DawgDictionary._VERSION:
+                buf.close()
+                raise ValueError("File {0} is not a packed {1} file of version {2}"
+                    .format(fname, self._SIGNATURE.decode("ascii"), DawgDictionary._VERSION))
+            if len(buf) != hsize + length:
+                # The file was truncated, or otherwise not completely written
+                size = len(buf) - hsize
+                buf.close()
+                raise ValueError("File {0} has {1} bytes of node data instead of {2}"
+                    .format(fname, size, length))
+            if source_hash is not None and source != source_hash:
+                buf.close()
+                raise ValueError("File {0} was not built from the current text file".format(fname))
+            self._buf = buf
+            # Add one to include the root in the node count
+            self._num_nodes = num_nodes + 1
+            # The root node immediately follows the header
+            self._root = _PackedNode(buf, hsize)
+
+    @staticmethod
+    def source_hash(fname):
+        """ Return the SHA-1 hash of a DAWG text file, as stored in snapshot
+            and packed binary headers """
+        h = hashlib.sha1()
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.digest()
+
+    @staticmethod
+    def snapshot_header(fname):
+        """ Read the header of a snapshot file, returning a dict of its fields,
+            or None if the file is missing or is not a snapshot of the current version """
+        try:
+            with open(fname, "rb") as f:
+                return DawgDictionary._read_snapshot_header(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _read_snapshot_header(f):
+        """ Read and check a snapshot header from an open file """
+        hdr = f.read(DawgDictionary._snapshot_struct.size)
+        if len(hdr) < DawgDictionary._snapshot_struct.size:
+            raise ValueError("Snapshot file is too short")
+        (sig, version, byteorder, itemsize, source_hash,
+            num_nodes, num_edges, num_labels, checksum, lena) = DawgDictionary._snapshot_struct.unpack(hdr)
+        if sig != DawgDictionary._SNAPSHOT_SIGNATURE or version != DawgDictionary._SNAPSHOT_VERSION:
+            raise ValueError("Not a snapshot file of version {0}".format(DawgDictionary._SNAPSHOT_VERSION))
+        return dict(version = version, byteorder = byteorder, itemsize = itemsize,
+            source_hash = source_hash, num_nodes = num_nodes, num_edges = num_edges,
+            num_labels = num_labels, checksum = checksum,
+            alphabet = f.read(lena).decode('utf-8'))
+
+    def store_snapshot(self, fname, source_hash):
+        """ Store a compact graph, as loaded by load_compact(), in a snapshot file.
+            The source_hash identifies the text file that the graph was loaded from. """
+        graph = self._compact
+        if graph is None:
+            raise ValueError("Only a compact graph can be stored in a snapshot")
+        data = b"".join(a.tostring() for a in graph.arrays())
+        alphabet = self._ALPHABET.encode('utf-8')
+        hdr = DawgDictionary._snapshot_struct.pack(DawgDictionary._SNAPSHOT_SIGNATURE,
+            DawgDictionary._SNAPSHOT_VERSION, 0 if sys.byteorder == "little" else 1,
+            graph.child.itemsize, source_hash, graph.num_nodes(), len(graph.child),
+            len(graph.labels), zlib.crc32(data) & 0xFFFFFFFF, len(alphabet))
+        # Write to a temporary file and rename it, so that readers never see a partial file
+        tname = "{0}.{1}.tmp".format(fname, os.getpid())
+        with open(tname, "wb") as f:
+            f.write(hdr)
+            f.write(alphabet)
+            f.write(data)
+        if os.path.exists(fname) and os.name == "nt":
+            # Windows does not allow renaming over an existing file
+            os.remove(fname)
+        os.rename(tname, fname)
+
+    def load_snapshot(self, fname, source_hash = None):
+        """ Load a compact graph from a snapshot file, with a few bulk reads.
+            If source_hash is given, it must match the hash stored in the header. """
+        with self._lock:
+            if self._root is not None:
+                # Already loaded
+                return
+            with open(fname, "rb") as f:
+                header = DawgDictionary._read_snapshot_header(f)
+                if source_hash is not None and header["source_hash"] != source_hash:
+                    raise ValueError("Snapshot file {0} is stale".format(fname))
+                data = f.read()
+            if header["alphabet"] != self._ALPHABET:
+                raise ValueError("Snapshot file {0} has a different alphabet".format(fname))
+            graph = _CompactGraph()
+            if header["itemsize"] != graph.child.itemsize:
+                raise ValueError("Snapshot file {0} has incompatible array items".format(fname))
+            if zlib.crc32(data) & 0xFFFFFFFF != header["checksum"]:
+                raise ValueError("Snapshot file {0} is corrupt".format(fname))
+            num_nodes = header["num_nodes"]
+            num_edges = header["num_edges"]
+            counts = (num_nodes, num_nodes + 1, num_edges + 1, header["num_labels"], num_edges,
+                num_nodes, num_nodes, num_nodes)
+            swap = header["byteorder"] != (0 if sys.byteorder == "little" else 1)
+            ix = 0
+            for a, count in zip(graph.arrays(), counts):
+                size = a.itemsize * count
+                a.fromstring(data[ix:ix + size])
+                if swap:
+                    a.byteswap()
+                ix += size
+            if ix != len(data):
+                raise ValueError("Snapshot file {0} has an invalid length".format(fname))
+            self._compact = graph
+            self._num_nodes = graph.num_nodes()
+            self._root = graph.root()
+
+    def share(self):
+        """ Move a compact graph into an anonymous shared memory mapping, in the
+            packed binary format, and navigate it in place from then on.
+            Call this in the master process of a pre-forking server, before the
+            workers are forked: the workers inherit the mapping and share its
+            physical memory pages instead of each holding a copy of the graph.
+            A graph that was loaded by load_binary() is already backed by
+            a file mapping that is shared between processes. """
+        if mmap is None:
+            raise ValueError("Memory mapping is not supported in this environment")
+        with self._lock:
+            if self._buf is not None:
+                # Already a mapped buffer: nothing to do
+                return
+            if self._compact is None:
+                raise ValueError("Only a compact graph can be moved to shared memory")
+            data = self._compact.pack()
+            # An anonymous mapping is shared with child processes after fork()
+            buf = mmap.mmap(-1, len(data))
+            buf[:] = bytes(data)
+            self._buf = buf
+            self._root = _PackedNode(buf, DawgDictionary._header_struct.size)
+            # Release the arrays
+            self._compact = None
+
+    def memory_size(self):
+        """ Return the number of bytes occupied by the graph, or 0 if not known """
+        if self._buf is not None:
+            return len(self._buf)
+        if self._compact is not None:
+            return self._compact.memory_size()
+        # The size of a graph of node objects is not readily available
+        return 0
+
+    def is_shared(self):
+        """ Returns True if the graph is navigated in place from a memory mapping,
+            which is shared with any processes forked after it was created """
+        return self._buf is not None
 
     def num_nodes(self):
         """ Return a count of unique nodes in the DAWG """
-        return 0 if self._nodes is None else len(self._nodes)
+        return self._num_nodes
 
     def find(self, word):
         """ Look for a word in the graph, returning True if it is found or False if not """
@@ -168,30 +1036,261 @@ class DawgDictionary:
         """ Enable simple lookup syntax: "word" in dawgdict """
         return self.find(word)
 
-    def find_matches(self, pattern, sort=True):
+    def find_many(self, words):
+        """ Look for a batch of words in the graph, returning a list of booleans
+            in the same order as the words. The batch is sorted and the graph
+            walked once, with consecutive words sharing the traversal of their
+            common prefix. """
+        words = list(words)
+        result = [False] * len(words)
+        if self._root is None:
+            return result
+        # path[i] is the position in the graph after the first i letters of
+        # the previous word, as a tuple (nextnode, prefix, j, final): j is the
+        # index into the edge prefix leading to nextnode, and final is True if
+        # the letters so far form a complete word. When j reaches the end of
+        # the prefix we are at nextnode, ready to choose an outgoing edge.
+        path = [(self._root, u'', 0, False)]
+        prev = u''
+        for ix in sorted(xrange(len(words)), key = words.__getitem__):
+            word = words[ix]
+            lenw = len(word)
+            # Back up to the longest prefix shared with the previous word
+            # that is still on the path
+            n = min(lenw, len(path) - 1)
+            i = 0
+            while i < n and word[i] == prev[i]:
+                i += 1
+            del path[i + 1:]
+            nextnode, prefix, j, final = path[i]
+            while i < lenw:
+                if j >= len(prefix):
+                    # At a node: find the edge that starts with the next letter
+                    edge = None if nextnode is None else nextnode.edge(word[i])
+                    if edge is None:
+                        break
+                    prefix, nextnode = edge
+                    j = 0
+                elif prefix[j] != word[i]:
+                    break
+                i += 1
+                j += 1
+                if j < len(prefix):
+                    final = prefix[j] == u'|'
+                    if final:
+                        j += 1
+                else:
+                    final = (nextnode is None) or nextnode.final
+                path.append((nextnode, prefix, j, final))
+            result[ix] = lenw > 0 and i == lenw and final
+            prev = word
+        return result
+
+    def find_matches(self, pattern, sort=True, budget=None):
         """ Returns a list of words matching a pattern.
             The pattern contains characters and '?'-signs denoting wildcards.
             Characters are matched exactly, while the wildcards match any character.
+            The pattern can also use the extended pattern language described
+            in _CompiledPattern, with letter sets such as [aeiou] and [^aeiou],
+            '*' for any sequence of letters, '^' and '$' anchors and {m,n} length
+            limits. Raises ValueError if the pattern is invalid.
+            The words are found in alphabetical order, as the edges of the graph
+            are stored in that order, so the result is always sorted; the sort
+            parameter is retained for compatibility.
+            If a Budget is given, the search stops when it runs out, and the
+            words found so far are returned; see navigate().
         """
-        nav = MatchNavigator(pattern, sort)
-        self.navigate(nav)
+        nav = DawgDictionary._match_navigator(pattern, sort)
+        self.navigate(nav, budget)
+        return nav.result()
+
+    @staticmethod
+    def _match_navigator(pattern, sort):
+        """ Return a MatchNavigator for a pattern of letters and '?' wildcards,
+            or a PatternNavigator for a pattern in the extended pattern language """
+        if all(c == u'?' or c in _LETTER_CODE for c in pattern):
+            return MatchNavigator(pattern, sort)
+        return PatternNavigator(pattern)
+
+    def find_combinations(self, rack, minlen = 0, budget = None):
+        """ Returns, from a single traversal, the permutations of a rack together
+            with the words that can be formed from the whole rack plus one additional
+            letter. The result is a list of (word, letter) tuples, where letter is None
+            for permutations and the additional letter for combinations, sorted in
+            descending order by word length. An optional Budget limits the
+            search, as in find_permutations().
+        """
+        nav = CombinationNavigator(rack, minlen)
+        self.navigate(nav, budget)
         return nav.result()
 
-    def find_permutations(self, rack, minlen = 0):
+    def find_permutations(self, rack, minlen = 0, maxlen = None, scored = False, budget = None):
         """ Returns a list of legal permutations of a rack of letters.
             The list is sorted in descending order by permutation length.
             The rack may contain question marks '?' as wildcards, matching all letters.
             Question marks should be used carefully as they can
             yield very large result sets.
+            If minlen and/or maxlen are given, only permutations of those
+            lengths are returned.
+            If scored is True, the list contains (word, score, blanks) tuples,
+            where score is the sum of the scores of the rack tiles used, not counting
+            blanks, and blanks is a tuple of the positions in the word that are filled
+            by blanks. Letters are taken from the rack in preference to blanks,
+            so each word occurs only once, with the highest score possible.
+            If a Budget is given, the search stops when it runs out, and the
+            words found so far are returned; see navigate().
         """
-        nav = PermutationNavigator(rack, minlen)
-        self.navigate(nav)
+        nav = PermutationNavigator(rack, minlen, maxlen, scored)
+        self.navigate(nav, budget)
         return nav.result()
 
-    def navigate(self, nav):
+    def find_placements(self, template, rack, minlen = 2, budget = None, anchors = None, checks = None):
+        """ Returns a list of the words that can be placed on a line of the board.
+            The template has a character for each square of the line: a letter for
+            a tile on the board, or '.' for an empty square. Words are formed by
+            filling empty squares with tiles from the rack, which may contain blanks
+            ('?'), and each word uses at least one rack tile. A word cannot start
+            right after, or end right before, a tile on the board, as that
+            tile would be part of it. By default words have at least two letters,
+            since a single letter does not form a word on the board.
+            If anchors is given, it is a list of the indices of empty squares,
+            typically those next to tiles on the board, and each word must
+            cover at least one of them. If checks is given, it is a list of
+            cross-checks for the squares, as for PlacementNavigator, limiting
+            the letters that may be placed on each of them.
+            The result is a list of (start, word, blanks) tuples, where start is
+            the index of the first square of the word and blanks is a tuple of
+            the positions in the word that are filled by blanks. The tuples are
+            ordered by start, and then alphabetically. Raises ValueError if the
+            template is invalid. An optional Budget limits the search, as in
+            find_permutations().
+        """
+        squares = _template_squares(template)
+        if anchors is not None:
+            anchors = _anchor_list(squares, anchors)
+        checks = _check_list(squares, checks)
+        result = []
+        for start in range(len(template)):
+            if start > 0 and template[start - 1] != u'.':
+                # The tile on the previous square would be part of the word
+                continue
+            least = minlen
+            if anchors is not None:
+                # The word must reach the first anchor at or after its start
+                following = [a for a in anchors if a >= start]
+                if not following:
+                    break
+                if template.count(u'.', start, following[0] + 1) > len(rack):
+                    # Not enough tiles to fill the squares up to the anchor
+                    continue
+                least = max(minlen, following[0] - start + 1)
+            nav = PlacementNavigator(template[start:], rack, least, checks[start:])
+            self.navigate(nav, budget)
+            result.extend((start, word, blanks) for word, blanks in nav.result())
+            if budget is not None and budget.exhausted():
+                break
+        return result
+
+    def iter_matches(self, pattern, limit = None, budget = None):
+        """ Returns an iterator over words matching a pattern, as in find_matches(),
+            in alphabetical order. Words are generated as the graph is traversed, and the traversal stops as
+            soon as the consumer stops iterating, after limit words, or when
+            the optional Budget runs out.
+        """
+        return self._iterate(DawgDictionary._match_navigator(pattern, False), limit, budget)
+
+    def iter_permutations(self, rack, minlen = 0, maxlen = None, limit = None, budget = None):
+        """ Returns an iterator over legal permutations of a rack of letters,
+            as in find_permutations(), but in alphabetical order instead of
+            grouped by length. Words are generated as the graph is traversed,
+            and the traversal stops as soon as the consumer stops iterating,
+            after limit words, or when the optional Budget runs out.
+        """
+        return self._iterate(PermutationNavigator(rack, minlen, maxlen), limit, budget)
+
+    def _iterate(self, nav, limit, budget):
+        """ Return an iterator over the words found by a navigator, up to an optional limit """
+        words = Navigation(nav, budget).iterate(self._root)
+        return words if limit is None else itertools.islice(words, limit)
+
+    def page_matches(self, pattern, count, token = None, budget = None):
+        """ Returns a page of up to count words matching a pattern, in alphabetical
+            order, as a tuple (words, token). If there are more words, token is an
+            opaque continuation token, to be passed to a subsequent call with the
+            same pattern to obtain the next page; otherwise it is None.
+            Resuming does not repeat the traversal of the previous pages, so each
+            page costs about the same regardless of how far into the result it is.
+            An optional Budget limits the work per page; if it runs out, the words
+            found so far, if any, are returned with a token to continue from the
+            point that the navigation reached, so that each call makes progress.
+        """
+        return self._page(DawgDictionary._match_navigator(pattern, False), u"m" + pattern,
+            count, token, budget)
+
+    def page_permutations(self, rack, count, token = None, minlen = 0, maxlen = None, budget = None):
+        """ Returns a page of up to count permutations of a rack, in alphabetical
+            order, as a tuple (words, token); see page_matches() """
+        query = u"p{0}:{1}:{2}".format(u''.join(sorted(rack)), minlen, maxlen)
+        return self._page(PermutationNavigator(rack, minlen, maxlen), query,
+            count, token, budget)
+
+    def _page(self, nav, query, count, token, budget):
+        """ Return a page of words found by a navigator, and a continuation token """
+        if count < 1:
+            raise ValueError("Page size must be at least 1")
+        after = None if token is None else DawgDictionary._token_position(token, query)
+        navigation = Navigation(nav, budget)
+        words = navigation.iterate(self._root, after)
+        # Look for one more word than requested, to see whether there is a next page
+        page = list(itertools.islice(words, count + 1))
+        if len(page) > count:
+            del page[count:]
+            return page, DawgDictionary._make_token(query, page[-1])
+        if navigation.stopped is not None:
+            # Out of budget: continue from the node that could not be entered
+            return page, DawgDictionary._make_token(query, navigation.stopped)
+        if budget is not None and budget.exhausted():
+            # The budget ran out before this call, which found no node
+            # to enter: continue from where it got to
+            return page, DawgDictionary._make_token(query, page[-1] if page else after or u'')
+        # No more words
+        return page, None
+
+    @staticmethod
+    def _make_token(query, path):
+        """ Return a continuation token for resuming a query after the given path
+            through the graph: the last word of a page, or the path to the node
+            that the navigation could not enter when its budget ran out. Since the
+            edges of the graph are in alphabetical order, the navigation has been
+            through all words up to and including the path, whether or not it is
+            a word itself, and the stack of edges leading to it is recovered by
+            following it. The token also contains a digest of the query, to catch
+            tokens that are passed with a different query. """
+        digest = hashlib.sha1(query.encode("utf-8")).digest()[0:6]
+        return base64.urlsafe_b64encode(digest + path.encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def _token_position(token, query):
+        """ Return the path after which a query is to be resumed, from a continuation token """
+        try:
+            raw = base64.urlsafe_b64decode(token.encode("ascii"))
+            path = raw[6:].decode("utf-8")
+        except (TypeError, ValueError, UnicodeError):
+            raise ValueError("Invalid continuation token")
+        if raw[0:6] != hashlib.sha1(query.encode("utf-8")).digest()[0:6]:
+            raise ValueError("The continuation token does not belong to this query")
+        return path
+
+    def navigate(self, nav, budget = None):
         """ A generic function to navigate through the DAWG under
             the control of a navigation object.
 
+            If a Budget object is given, the navigation stops when the budget
+            runs out, i.e. when a maximum number of graph nodes has been visited
+            or a deadline has passed. The navigator is then left with the results
+            found so far, done() is called as usual, and budget.exhausted()
+            returns True so that the caller knows the result is partial.
+
             The navigation object should implement the following interface:
 
             def push_edge(firstchar)
@@ -207,104 +1306,415 @@ class DawgDictionary:
                 if there is no need to visit other edges
             def done()
                 called when the navigation is completed
+
+            Optionally, the navigation object can also implement:
+
+            def accepts_node(node)
+                called before navigating onwards from a node; returns False if the
+                navigator is not interested in any continuation from it, for instance
+                because none of the letters in node.mask can be matched
         """
-        if self._nodes is None:
+        if self._root is None:
             # No graph: no navigation
             nav.done()
             return
-        root = self._nodes[0] # Start at the root
-        Navigation(nav).go(root)
+        Navigation(nav, budget).go(self._root) # Start at the root
+
+
+class GaddagDictionary(DawgDictionary):
+
+    """ A word dictionary implemented with a GADDAG, for move generation.
+
+        The graph is built by DawgBuilder with gaddag = True, and contains each
+        word once for every letter in it: the letters from that letter back to the
+        start of the word, followed by GADDAG_SEPARATOR and the rest of the word
+        (the separator is left out if the rest is empty). A navigation can thus
+        start at a letter placed on an anchor square of the board and grow the
+        word outwards, first leftwards and then rightwards, instead of having to
+        try every starting square to the left of the anchor as with a DAWG.
+
+        A GADDAG is loaded like a DAWG, with load(), load_compact(), load_binary()
+        (from a '.gaddag' file) or load_snapshot(). Words are looked up with find(),
+        find_many() and the 'in' operator, and moves are generated by find_placements().
+        The other query functions of DawgDictionary traverse the graph as a DAWG, and
+        raise ValueError if called on a GADDAG.
+    """
+
+    _SIGNATURE = b"GDAG"
+    _ALPHABET = _EDGE_CODING
+
+    @staticmethod
+    def _path(word):
+        """ Return the path of a word through the GADDAG that starts with its first letter """
+        return word[0] + GADDAG_SEPARATOR + word[1:] if len(word) > 1 else word
+
+    def find(self, word):
+        """ Look for a word in the graph, returning True if it is found or False if not """
+        nav = FindNavigator(GaddagDictionary._path(word))
+        self.navigate(nav)
+        return nav.is_found()
+
+    def find_many(self, words):
+        """ Returns a list of booleans, one for each word in the given batch """
+        return [self.find(word) for word in words]
+
+    def find_placements(self, template, rack, minlen = 2, budget = None, anchors = None, checks = None):
+        """ Returns a list of the words that can be placed on a line of the board,
+            as in DawgDictionary.find_placements(). Each anchor square is the
+            starting point of a navigation that grows words outwards from it.
+            A word is only generated from the leftmost anchor that it covers, so
+            the navigation from an anchor does not extend to the left of the
+            previous one. If anchors is None, all empty squares are anchors.
+        """
+        squares = _template_squares(template)
+        result = []
+        leftmost = 0
+        for anchor in _anchor_list(squares, anchors):
+            nav = GaddagNavigator(template, rack, anchor, leftmost, minlen, checks)
+            self.navigate(nav, budget)
+            result.extend(nav.result())
+            if budget is not None and budget.exhausted():
+                break
+            leftmost = anchor + 1
+        # Order the words by their start, and then alphabetically
+        code = _LETTER_CODE
+        result.sort(key = lambda x: (x[0], [code[c] for c in x[1]]))
+        return result
+
+    @staticmethod
+    def _check(nav):
+        """ Raise ValueError if a navigator traverses the graph as a DAWG """
+        if isinstance(nav, (MatchNavigator, PatternNavigator, PermutationNavigator, PlacementNavigator)):
+            raise ValueError("{0} cannot be used with a GADDAG".format(nav.__class__.__name__))
+
+    def navigate(self, nav, budget = None):
+        """ Navigate through the GADDAG under the control of a navigation object,
+            as in DawgDictionary.navigate() """
+        GaddagDictionary._check(nav)
+        DawgDictionary.navigate(self, nav, budget)
+
+    def _iterate(self, nav, limit, budget):
+        GaddagDictionary._check(nav)
+        return DawgDictionary._iterate(self, nav, limit, budget)
+
+    def _page(self, nav, query, count, token, budget):
+        GaddagDictionary._check(nav)
+        return DawgDictionary._page(self, nav, query, count, token, budget)
 
 
 class Wordbase:
 
-    """ Container for a singleton instance of the word database """
+    """ A registry of word databases, each loaded at most once per process.
+
+        Dictionaries are keyed by name, which is the common stem of their files
+        in the resources folder ('ordalisti' for the Icelandic word list). A DAWG
+        is loaded upon first request, under a lock so that concurrent first
+        requests share a single load, and the same read-only graph is then handed
+        out to all callers. The source, load time and memory use of each loaded
+        dictionary are available from Wordbase.stats(). Wordbase.reload() replaces
+        a dictionary with a freshly loaded version, without interrupting service.
+    """
 
-    _dawg = None
+    # The default dictionary
+    DEFAULT = "ordalisti"
+
+    _dawgs = dict()
+    _stats = dict()
+    # Names of dictionaries that are being reloaded
+    _reloading = set()
     _lock = threading.Lock()
 
     @staticmethod
-    def _load():
-        """ Load a DawgDictionary, from either a text file or a pickle file """
+    def _read(name):
+        """ Read a DawgDictionary, from a packed binary file, a snapshot file or a text file,
+            returning the dictionary and a dict of statistics about it """
+        fname = os.path.abspath(os.path.join("resources", name + ".text.dawg"))
+        bname = os.path.abspath(os.path.join("resources", name + ".dawg"))
+        sname = os.path.abspath(os.path.join("resources", name + ".dawg.snapshot"))
+        # The packed binary and snapshot files are fresh if they were made from
+        # the current text file, as identified by the source hash in their headers.
+        # The text file is only hashed if there is such a header to check, and
+        # if it is missing, the other files are used as they are.
+        hashed = []
+
+        def source_hash():
+            """ Return the hash of the text file, calculating it upon first use """
+            if not hashed:
+                hashed.append(DawgDictionary.source_hash(fname) if os.path.exists(fname) else None)
+            return hashed[0]
+
+        dawg = DawgDictionary()
+        source = None
+        t0 = time.time()
+
+        if mmap is not None and os.path.exists(bname):
+            # We have a packed binary file: memory-map it if it is fresh
+            logging.info(u"Instance {0} loading DAWG from binary file {1}"
+                .format(os.environ.get("INSTANCE_ID", ""), bname))
+            try:
+                dawg.load_binary(bname, source_hash())
+                source = bname
+            except ValueError as e:
+                # Binary file of an older format version, or built from another
+                # version of the text file: fall back to the snapshot or the text file below
+                logging.warning(u"Unable to load binary file {0}: {1}".format(bname, e))
+        if source is None and os.path.exists(sname):
+            # We have a snapshot: use it if it was made from the current text file
+            logging.info(u"Instance {0} loading DAWG from snapshot file {1}"
+                .format(os.environ.get("INSTANCE_ID", ""), sname))
+            try:
+                dawg.load_snapshot(sname, source_hash())
+                source = sname
+            except ValueError as e:
+                # Stale, corrupt or incompatible snapshot: fall back to the text file below
+                logging.warning(u"Unable to load snapshot file {0}: {1}".format(sname, e))
+
+        if source is None:
+            # Load from the text file, and store a snapshot for next time
+            logging.info(u"Instance {0} loading DAWG from text file {1}"
+                .format(os.environ.get("INSTANCE_ID", ""), fname))
+            dawg.load_compact(fname)
+            source = fname
+            try:
+                dawg.store_snapshot(sname, source_hash())
+            except (IOError, OSError) as e:
+                # The file system may be read-only: carry on without a snapshot
+                logging.warning(u"Unable to store snapshot file {0}: {1}".format(sname, e))
+
+        t1 = time.time()
+        logging.info(u"Loaded {0} graph nodes ({1} KB) in {2:.2f} seconds"
+            .format(dawg.num_nodes(), dawg.memory_size() // 1024, t1 - t0))
+        stats = dict(source = source, nodes = dawg.num_nodes(), load_time = t1 - t0,
+            memory = dawg.memory_size(), shared = dawg.is_shared(), loaded_at = t1)
+        return dawg, stats
+
+    @staticmethod
+    def _load(name):
+        """ Load a DawgDictionary into the registry, if not already loaded """
         with Wordbase._lock:
-            if Wordbase._dawg is not None:
+            if name in Wordbase._dawgs:
                 # Already loaded: nothing to do
                 return
-            # Compare the file times of the text version vs. the pickled version
-            fname = os.path.abspath(os.path.join("resources", "ordalisti.text.dawg"))
-            pname = os.path.abspath(os.path.join("resources", "ordalisti.dawg.pickle"))
-            try:
-                fname_t = os.path.getmtime(fname)
-            except os.error:
-                fname_t = None
-            try:
-                pname_t = os.path.getmtime(pname)
-            except os.error:
-                pname_t = None
+            dawg, stats = Wordbase._read(name)
+            # Do not register the dawg until fully loaded, to prevent race conditions
+            Wordbase._stats[name] = stats
+            Wordbase._dawgs[name] = dawg
 
-            dawg = DawgDictionary()
+    @staticmethod
+    def reload(name = DEFAULT, wait = False):
+        """ Reload a dictionary from its files, typically after a rebuild, without
+            interrupting service. The new graph is loaded in a background thread
+            (or in the calling thread if wait is True) while the old one continues
+            to serve requests, and is then swapped into the registry in one step.
+            Navigations in progress finish on the old graph, which is released
+            when no longer referenced. Returns the thread, or None if wait is True
+            or a reload of the dictionary is already in progress. """
+        with Wordbase._lock:
+            if name in Wordbase._reloading:
+                return None
+            Wordbase._reloading.add(name)
 
-            if fname_t is not None and pname_t is not None and pname_t >= fname_t:
-                # We have a newer pickle file: use it
-                logging.info(u"Instance {0} loading DAWG from pickle file {1}"
-                    .format(os.environ.get("INSTANCE_ID", ""), pname))
-                t0 = time.time()
-                dawg.load_pickle(pname)
-                t1 = time.time()
-                logging.info(u"Loaded {0} graph nodes in {1:.2f} seconds".format(dawg.num_nodes(), t1 - t0))
-            else:
-                # Load in the traditional way, from the text file
-                logging.info(u"Instance {0} loading DAWG from text file {1}"
-                    .format(os.environ.get("INSTANCE_ID", ""), fname))
+        def do_reload():
+            try:
+                dawg, stats = Wordbase._read(name)
+                with Wordbase._lock:
+                    stats["reloads"] = Wordbase._stats.get(name, {}).get("reloads", 0) + 1
+                    Wordbase._stats[name] = stats
+                    Wordbase._dawgs[name] = dawg
+                logging.info(u"Dictionary {0} reloaded".format(name))
+            except Exception as e:
+                # Keep serving from the old graph
+                logging.error(u"Unable to reload dictionary {0}: {1}".format(name, e))
+            finally:
+                with Wordbase._lock:
+                    Wordbase._reloading.discard(name)
+
+        if wait:
+            do_reload()
+            return None
+        thread = threading.Thread(target = do_reload, name = "reload-" + name)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    @staticmethod
+    def load_shared(name = DEFAULT):
+        """ Load the word database and move it into shared memory, for use in the master
+            process of a pre-forking server before the worker processes are forked """
+        dawg = Wordbase.dawg(name)
+        with Wordbase._lock:
+            if not dawg.is_shared():
                 t0 = time.time()
-                dawg.load(fname)
+                dawg.share()
                 t1 = time.time()
-                logging.info(u"Loaded {0} graph nodes in {1:.2f} seconds".format(dawg.num_nodes(), t1 - t0))
+                logging.info(u"Moved {0} graph nodes to shared memory in {1:.2f} seconds"
+                    .format(dawg.num_nodes(), t1 - t0))
+                stats = Wordbase._stats[name]
+                stats["memory"] = dawg.memory_size()
+                stats["shared"] = True
+        return dawg
 
-            # Do not assign Wordbase._dawg until fully loaded, to prevent race conditions
-            Wordbase._dawg = dawg
+    @staticmethod
+    def dawg(name = DEFAULT):
+        """ Return the DawgDictionary of the given name, loading it if required """
+        dawg = Wordbase._dawgs.get(name)
+        if dawg is None:
+            Wordbase._load(name)
+            dawg = Wordbase._dawgs[name]
+        return dawg
 
     @staticmethod
-    def dawg():
-        if Wordbase._dawg is None:
-            Wordbase._load()
-        assert Wordbase._dawg is not None
-        return Wordbase._dawg
+    def stats():
+        """ Return a dict of loaded dictionaries, each with a dict of its source file,
+            node count, load time in seconds, memory use in bytes and shared status """
+        with Wordbase._lock:
+            return dict((name, dict(stats)) for name, stats in Wordbase._stats.items())
+
+
+class Budget:
+
+    """ Limits the work done by a navigation, as a maximum number of graph
+        nodes visited and/or a wall-clock deadline, given in seconds from
+        the creation of the budget. None means no limit.
+
+        A budget is passed to DawgDictionary.navigate() or to one of the query
+        functions built on it. The navigation loops obtain nodes from the budget
+        in small batches through grant(), so that the clock is only consulted
+        once per batch, and refund() the rest of the last batch when they finish.
+        Several navigations can thus share a budget in turn. When the budget runs
+        out the navigation stops, and exhausted() returns True to flag the result
+        as partial.
+    """
+
+    # The number of nodes granted at a time
+    _BATCH = 256
+
+    def __init__(self, nodes = None, seconds = None):
+        self._nodes = nodes
+        self._deadline = None if seconds is None else time.time() + seconds
+        self._granted = 0
+        self._exhausted = False
+
+    def grant(self):
+        """ Returns the number of nodes that may be visited before grant()
+            is called again, or 0 if the budget has run out """
+        if self._exhausted:
+            return 0
+        n = Budget._BATCH
+        if self._nodes is not None:
+            n = min(n, self._nodes - self._granted)
+        if n <= 0 or (self._deadline is not None and time.time() >= self._deadline):
+            self._exhausted = True
+            return 0
+        self._granted += n
+        return n
+
+    def refund(self, n):
+        """ Returns nodes that were granted but not visited to the budget,
+            as when a navigation finishes before using its last batch """
+        self._granted -= n
+
+    def used(self):
+        """ Returns the number of nodes granted and not refunded, i.e. the
+            number of nodes visited once the navigations have finished """
+        return self._granted
+
+    def exhausted(self):
+        """ Returns True if the budget ran out, i.e. a navigation was cut short """
+        return self._exhausted
 
 
 class Navigation:
 
-    """ Manages the state for a navigation while it is in progress """
+    """ Manages the state for a navigation while it is in progress.
+
+        The navigation is iterative, using an explicit stack of nodes
+        instead of recursion. Navigators implementing the generic protocol
+        (see DawgDictionary.navigate()) are driven through their interface
+        functions, while the built-in navigators (FindNavigator, MatchNavigator,
+        PatternNavigator, PermutationNavigator, CombinationNavigator, PlacementNavigator
+        and GaddagNavigator) are run by specialized loops that do the same work
+        without a method call per character.
+
+        If a Budget is given, every node entered is charged to it, and
+        the navigation stops when it runs out. Finding a single word
+        visits at most one node per letter and is not charged, and neither
+        is following the path back to the position where a paginated
+        navigation resumes. When an iterated navigation runs out of budget,
+        the path to the node that it could not enter is kept in stopped.
+    """
 
-    def __init__(self, nav):
+    def __init__(self, nav, budget = None):
         self._nav = nav
+        self._budget = budget
+        self.stopped = None
         # If the navigator has a method called accept_resumable(),
         # note it and call it with additional state information instead of
         # plain accept()
         self._resumable = callable(getattr(nav, "accept_resumable", None))
+        # If the navigator has a method called accepts_node(), call it
+        # to check whether it is worthwhile to continue through a node
+        self._filtering = callable(getattr(nav, "accepts_node", None))
 
     def _navigate_from_node(self, node, matched):
         """ Starting from a given node, navigate outgoing edges """
-        # Go through the edges of this node and follow the ones
-        # okayed by the navigator
-        for prefix, nextnode in node.edges.items():
-            if self._nav.push_edge(prefix[0]):
-                # This edge is a candidate: navigate through it
-                self._navigate_from_edge(prefix, nextnode, matched)
-                if not self._nav.pop_edge():
-                    # Short-circuit and finish the loop if pop_edge() returns False
-                    break
+        nav = self._nav
+        # The number of nodes that can be entered before more
+        # must be requested from the budget, if there is one
+        budget = self._budget
+        allowance = sys.maxsize if budget is None else 0
+        # The stack contains an iterator over the remaining edges of each
+        # node on the current path, along with the matched string at that node
+        stack = [(iter(node.edge_list), matched)]
+        try:
+            while stack:
+                edges, matched = stack[-1]
+                descending = False
+                # Go through the edges of this node and follow the ones
+                # okayed by the navigator
+                for prefix, nextnode in edges:
+                    if nav.push_edge(prefix[0]):
+                        # This edge is a candidate: navigate through it
+                        nextmatched = self._navigate_from_edge(prefix, nextnode, matched)
+                        if nextmatched is not None and (not self._filtering or nav.accepts_node(nextnode)):
+                            # Continue with the next node, if the budget allows;
+                            # pop_edge() will be called once we are done with it
+                            if not allowance:
+                                allowance = budget.grant()
+                                if not allowance:
+                                    return
+                            allowance -= 1
+                            stack.append((iter(nextnode.edge_list), nextmatched))
+                            descending = True
+                            break
+                        if not nav.pop_edge():
+                            # Short-circuit and finish the loop if pop_edge() returns False
+                            break
+                if not descending:
+                    # Done with this node: leave it, along with the edge that led to it,
+                    # and continue with the next edge of the parent node
+                    # (unless the navigator short-circuits the parent as well)
+                    stack.pop()
+                    while stack and not nav.pop_edge():
+                        stack.pop()
+        finally:
+            # Return the nodes that were granted but not entered
+            if budget is not None:
+                budget.refund(allowance)
 
     def _navigate_from_edge(self, prefix, nextnode, matched):
-        """ Navigate along an edge, accepting partial and full matches """
+        """ Navigate along an edge, accepting partial and full matches.
+            Returns the matched string if the navigation should continue
+            with the next node, or None if not. """
+        nav = self._nav
         # Go along the edge as long as the navigator is accepting
         lenp = len(prefix)
         j = 0
-        while j < lenp and self._nav.accepting():
+        while j < lenp and nav.accepting():
             # See if the navigator is OK with accepting the current character
-            if not self._nav.accepts(prefix[j]):
+            if not nav.accepts(prefix[j]):
                 # Nope: we're done with this edge
-                return
+                return None
             # So far, we have a match: add a letter to the matched path
             matched += prefix[j]
             j += 1
@@ -321,20 +1731,795 @@ class Navigation:
             if self._resumable:
                 # The navigator wants to know the position in the graph
                 # so that navigation can be resumed later from this spot
-                self._nav.accept_resumable(prefix[j:], nextnode, matched)
+                nav.accept_resumable(prefix[j:], nextnode, matched)
             else:
                 # Normal navigator: tell it about the match
-                self._nav.accept(matched, final)
+                nav.accept(matched, final)
         # We're done following the prefix for as long as it goes and
         # as long as the navigator was accepting
         if j < lenp:
             # We didn't complete the prefix, so the navigator must no longer
             # be interested (accepting): we're done
-            return
-        if self._nav.accepting() and (nextnode is not None):
+            return None
+        if nav.accepting() and (nextnode is not None):
             # Gone through the entire edge and still have rack letters left:
             # continue with the next node
-            self._navigate_from_node(nextnode, matched)
+            return matched
+        return None
+
+    def _find(self, root):
+        """ Specialized navigation loop for a FindNavigator """
+        nav = self._nav
+        word = nav._word
+        lenw = nav._len
+        node = root
+        i = 0
+        while True:
+            # Find the single edge that starts with the next letter of the word
+            edge = node.edge(word[i])
+            if edge is None:
+                return
+            prefix, nextnode = edge
+            # Match the edge prefix with the word, letter by letter
+            lenp = len(prefix)
+            j = 0
+            while j < lenp:
+                if i >= lenw or prefix[j] != word[i]:
+                    return
+                i += 1
+                j += 1
+                if j < lenp and prefix[j] == u'|':
+                    j += 1
+                    if i == lenw:
+                        # The word ends at a final letter within the prefix
+                        nav._found = True
+                        return
+            if i == lenw:
+                # The word ends at the end of the edge
+                nav._found = (nextnode is None) or nextnode.final
+                return
+            if nextnode is None:
+                return
+            node = nextnode
+
+    def _match(self, root, after = None):
+        """ Specialized navigation loop for a MatchNavigator, generating
+            matching words in the order in which they are found, i.e. in
+            alphabetical order. If after is given, only the words that
+            come after it are generated; see _positioned(). """
+        nav = self._nav
+        pattern = nav._pattern
+        lenpat = nav._lenp
+        required = nav._required
+        budget = self._budget
+        # Nodes are requested from the budget when they are first needed,
+        # so that it only runs out if the navigation is cut short
+        allowance = sys.maxsize if budget is None else 0
+        code = _LETTER_CODE
+        nonletter = len(Alphabet.full_order)
+        after_codes = None if after is None else [code.get(c, nonletter) for c in after]
+
+        def edges_for(node, chmatch):
+            """ Return the edges of the node that can match the pattern character """
+            if chmatch == u'?':
+                return iter(node.edge_list)
+            # Only one edge can start with a given letter
+            edge = node.edge(chmatch)
+            return iter(() if edge is None else (edge,))
+
+        # Each stack frame holds the edges to visit from a node, the letters
+        # matched so far, and whether they are on the path of the word to
+        # start after
+        stack = [(edges_for(root, pattern[0]), u'', after is not None)]
+        try:
+            while stack:
+                edges, matched, path = stack[-1]
+                index = len(matched)
+                descending = False
+                for prefix, nextnode in edges:
+                    lenp = len(prefix)
+                    i = index
+                    j = 0
+                    onpath = path
+                    while True:
+                        chmatch = pattern[i]
+                        if chmatch != u'?' and chmatch != prefix[j]:
+                            break
+                        if onpath:
+                            onpath, before = self._positioned(after_codes, i,
+                                code.get(prefix[j], nonletter))
+                            if before:
+                                # All words along this edge come before the starting point
+                                break
+                        i += 1
+                        j += 1
+                        if i == lenpat:
+                            # The whole pattern has been matched: is this a complete word?
+                            if j < lenp:
+                                final = (prefix[j] == u'|')
+                            else:
+                                final = (nextnode is None) or nextnode.final
+                            if final and not onpath:
+                                yield matched + prefix[0:j].replace(u'|', u'')
+                            break
+                        if j < lenp and prefix[j] == u'|':
+                            j += 1
+                        if j >= lenp:
+                            # Completed the edge with more of the pattern left to match.
+                            # Continue if a word of the right length can be completed
+                            # from the next node, and the letters that remain fixed in
+                            # the pattern all occur somewhere in its subgraph.
+                            if (nextnode is not None and
+                                nextnode.minlen <= lenpat - i <= nextnode.maxlen and
+                                (nextnode.mask & required[i]) == required[i]):
+                                m = matched + prefix.replace(u'|', u'')
+                                if not onpath:
+                                    # Charge the node to the budget, unless it is on the
+                                    # path to the starting point
+                                    if not allowance:
+                                        allowance = budget.grant()
+                                        if not allowance:
+                                            self.stopped = m
+                                            return
+                                    allowance -= 1
+                                stack.append((edges_for(nextnode, pattern[i]), m, onpath))
+                                descending = True
+                            break
+                    if descending:
+                        break
+                if not descending:
+                    stack.pop()
+        finally:
+            # Return the nodes that were granted but not entered
+            if budget is not None:
+                budget.refund(allowance)
+
+    def _pattern(self, root, after = None):
+        """ Specialized navigation loop for a PatternNavigator, generating
+            matching words in alphabetical order, optionally starting after
+            a given word as in _match() """
+        compiled = self._nav._compiled
+        next_states = compiled.next_states
+        is_final = compiled.is_final
+        info = compiled.info
+        viable = compiled.viable
+        maxlen = sys.maxsize if compiled.maxlen is None else compiled.maxlen
+        minlen = compiled.minlen
+        budget = self._budget
+        allowance = sys.maxsize if budget is None else 0
+        code = _LETTER_CODE
+        nonletter = len(Alphabet.full_order)
+        after_codes = None if after is None else [code.get(c, nonletter) for c in after]
+
+        def edges_for(node, state):
+            """ Return the edges of the node that can be entered in the given state """
+            letters = info(state)[3]
+            if letters is None:
+                return iter(node.edge_list)
+            return iter(node.matching_edges(letters))
+
+        # Each stack frame holds the edges to visit from a node, the letters
+        # matched so far, the state of the pattern automaton, and whether the
+        # letters are on the path of the word to start after
+        stack = [(edges_for(root, compiled.start), u'', compiled.start, after is not None)]
+        try:
+            while stack:
+                edges, matched, state, path = stack[-1]
+                descending = False
+                for prefix, nextnode in edges:
+                    lenp = len(prefix)
+                    m = matched
+                    st = state
+                    onpath = path
+                    j = 0
+                    while j < lenp and len(m) < maxlen:
+                        c = prefix[j]
+                        ix = code.get(c, nonletter)
+                        st = next_states(st)[ix]
+                        if not st:
+                            # The pattern does not match
+                            break
+                        if onpath:
+                            onpath, before = self._positioned(after_codes, len(m), ix)
+                            if before:
+                                # All words along this edge come before the starting point
+                                break
+                        m += c
+                        j += 1
+                        if j < lenp and prefix[j] == u'|':
+                            j += 1
+                            final = True
+                        else:
+                            final = (j >= lenp) and ((nextnode is None) or nextnode.final)
+                        if final and is_final(st) and len(m) >= minlen and not onpath:
+                            yield m
+                    if j >= lenp and nextnode is not None and viable(nextnode, st, len(m)):
+                        # Gone through the entire edge, and a matching word can
+                        # be completed from the next node: continue with it,
+                        # if the budget allows
+                        if not onpath:
+                            if not allowance:
+                                allowance = budget.grant()
+                                if not allowance:
+                                    self.stopped = m
+                                    return
+                            allowance -= 1
+                        stack.append((edges_for(nextnode, st), m, st, onpath))
+                        descending = True
+                        break
+                if not descending:
+                    stack.pop()
+        finally:
+            # Return the nodes that were granted but not entered
+            if budget is not None:
+                budget.refund(allowance)
+
+    def _permute(self, root, after = None):
+        """ Specialized navigation loop for a PermutationNavigator, generating
+            permutations in the order in which they are found, i.e. in
+            alphabetical order. If after is given, only the words that
+            come after it are generated; see _positioned(). """
+        nav = self._nav
+        minlen = nav._minlen
+        coding = Alphabet.full_order
+        code = _LETTER_CODE
+        # The rack is a vector of letter counts plus a count of blanks,
+        # updated in place. Letters taken from the rack along the current
+        # path are noted in the undo list (with -1 for a blank), so that
+        # they can be put back when the navigation backtracks. The navigator's
+        # count vector is copied, so that it remains intact even if the
+        # generator is abandoned before the navigation is complete.
+        counts = list(nav._counts)
+        blanks = nav._blanks
+        rack_codes = nav._codes
+        nonletter = nav._nonletter
+        # Maximum number of letters to take from the rack
+        limit = nav._maxlen
+        undo = []
+        take = undo.append
+        put_back = undo.pop
+        # If scoring, generate (word, score, blanks) tuples, where the score
+        # is the sum of the tiles taken from the rack along the path, and
+        # blanks is a tuple of the positions in the word where blanks were used
+        scored = nav._scored
+        scores = _LETTER_SCORES
+        budget = self._budget
+        allowance = sys.maxsize if budget is None else 0
+
+        after_codes = None if after is None else [code.get(c, nonletter) for c in after]
+
+        bits = _LETTER_BITS
+        # Bit patterns can only be used for pruning if all rack letters have a bit
+        maskable = all(bits[ix] for ix in rack_codes)
+
+        def edges_for(node, blanks):
+            """ Return the edges of the node that can be entered with the rack """
+            if blanks:
+                return iter(node.edge_list)
+            # No wildcards: only the edges starting with a letter left in the rack
+            letters = []
+            avail = 0
+            for ix in rack_codes:
+                if counts[ix]:
+                    letters.append(coding[ix])
+                    avail |= bits[ix]
+            if maskable and not (node.mask & avail):
+                # None of the remaining rack letters occur in the subgraph: skip it
+                return iter(())
+            return iter(node.matching_edges(letters))
+
+        # Each stack frame holds the edges to visit from a node, the letters
+        # matched so far, the length of the undo list when the node was entered,
+        # the score so far, a bit pattern of the positions filled by blanks, and
+        # whether the letters matched are on the path of the word to start after
+        stack = [(edges_for(root, blanks), u'', 0, 0, 0, after is not None)]
+        try:
+            while stack:
+                edges, matched, mark, score, blankpos, path = stack[-1]
+                descending = False
+                for prefix, nextnode in edges:
+                    # Put back the letters taken by the previous edge from this node
+                    while len(undo) > mark:
+                        ix = put_back()
+                        if ix < 0:
+                            blanks += 1
+                        else:
+                            counts[ix] += 1
+                    lenp = len(prefix)
+                    left = limit - mark
+                    m = matched
+                    sc = score
+                    bp = blankpos
+                    onpath = path
+                    j = 0
+                    while j < lenp and left:
+                        c = prefix[j]
+                        ix = code.get(c, nonletter)
+                        if onpath:
+                            onpath, before = self._positioned(after_codes, len(m), ix)
+                            if before:
+                                # All words along this edge come before the starting point
+                                break
+                        if counts[ix]:
+                            counts[ix] -= 1
+                            take(ix)
+                            sc += scores[ix]
+                        elif blanks:
+                            blanks -= 1
+                            take(-1)
+                            bp |= 1 << len(m)
+                        else:
+                            # No rack letter for this prefix letter
+                            break
+                        left -= 1
+                        m += c
+                        j += 1
+                        if j < lenp and prefix[j] == u'|':
+                            j += 1
+                            final = True
+                        else:
+                            final = (j >= lenp) and ((nextnode is None) or nextnode.final)
+                        if final and len(m) >= minlen and not onpath:
+                            if scored:
+                                yield (m, sc, tuple(i for i in range(len(m)) if bp >> i & 1) if bp else ())
+                            else:
+                                yield m
+                    if (j >= lenp and left and (nextnode is not None) and
+                        nextnode.minlen <= left and len(m) + min(left, nextnode.maxlen) >= minlen):
+                        # Gone through the entire edge and still have rack letters left,
+                        # enough to complete a word of the requested length:
+                        # continue with the next node, if the budget allows
+                        if not onpath:
+                            if not allowance:
+                                allowance = budget.grant()
+                                if not allowance:
+                                    self.stopped = m
+                                    return
+                            allowance -= 1
+                        stack.append((edges_for(nextnode, blanks), m, len(undo), sc, bp, onpath))
+                        descending = True
+                        break
+                if not descending:
+                    stack.pop()
+        finally:
+            # Return the nodes that were granted but not entered
+            if budget is not None:
+                budget.refund(allowance)
+
+    def _place(self, root):
+        """ Specialized navigation loop for a PlacementNavigator, generating
+            (word, blanks) tuples in the order in which they are found, i.e.
+            in alphabetical order """
+        nav = self._nav
+        squares = nav._squares
+        lent = nav._lent
+        ends = nav._ends
+        viable = nav.viable
+        coding = Alphabet.full_order
+        code = _LETTER_CODE
+        # The rack is handled as in _permute(); only the empty squares
+        # take tiles from it
+        counts = list(nav._counts)
+        blanks = nav._blanks
+        rack_codes = nav._codes
+        nonletter = nav._nonletter
+        undo = []
+        take = undo.append
+        put_back = undo.pop
+        budget = self._budget
+        allowance = sys.maxsize if budget is None else 0
+
+        bits = _LETTER_BITS
+        maskable = nav._maskable
+        checks = nav._checks
+        allowed = nav._allowed
+        if not ends:
+            # No word can fit the template
+            return
+
+        def edges_for(node, i, blanks):
+            """ Return the edges of the node that can be entered at position i """
+            square = squares[i]
+            if square is not None:
+                # Only the edge with the letter on the board
+                edge = node.edge(square)
+                return iter(() if edge is None else (edge,))
+            check = checks[i]
+            if blanks:
+                if check is None:
+                    return iter(node.edge_list)
+                # A blank can be any letter that the cross-check allows
+                return iter(node.matching_edges(allowed[i]))
+            letters = []
+            avail = 0
+            for ix in rack_codes:
+                if counts[ix] and (check is None or check & bits[ix]):
+                    letters.append(coding[ix])
+                    avail |= bits[ix]
+            if not letters or (maskable and not (node.mask & avail)):
+                return iter(())
+            return iter(node.matching_edges(letters))
+
+        # Each stack frame holds the edges to visit from a node, the letters
+        # matched so far, the length of the undo list when the node was
+        # entered, and a bit pattern of the positions filled by blanks
+        stack = [(edges_for(root, 0, blanks), u'', 0, 0)]
+        try:
+            while stack:
+                edges, matched, mark, blankpos = stack[-1]
+                descending = False
+                for prefix, nextnode in edges:
+                    # Put back the tiles taken by the previous edge from this node
+                    while len(undo) > mark:
+                        ix = put_back()
+                        if ix < 0:
+                            blanks += 1
+                        else:
+                            counts[ix] += 1
+                    lenp = len(prefix)
+                    m = matched
+                    bp = blankpos
+                    j = 0
+                    while j < lenp:
+                        i = len(m)
+                        if i >= lent:
+                            # Out of squares
+                            break
+                        c = prefix[j]
+                        square = squares[i]
+                        if square is not None:
+                            if c != square:
+                                break
+                        else:
+                            ix = code.get(c, nonletter)
+                            check = checks[i]
+                            if check is not None and not (check & bits[ix]):
+                                # The letter would not form a valid cross word
+                                break
+                            if counts[ix]:
+                                counts[ix] -= 1
+                                take(ix)
+                            elif blanks:
+                                blanks -= 1
+                                take(-1)
+                                bp |= 1 << i
+                            else:
+                                # No rack tile for this prefix letter
+                                break
+                        m += c
+                        j += 1
+                        if j < lenp and prefix[j] == u'|':
+                            j += 1
+                            final = True
+                        else:
+                            final = (j >= lenp) and ((nextnode is None) or nextnode.final)
+                        if final and (ends >> len(m)) & 1:
+                            yield (m, tuple(i for i in range(len(m)) if bp >> i & 1) if bp else ())
+                    if j >= lenp and nextnode is not None and len(m) < lent and viable(nextnode, len(m)):
+                        # Gone through the entire edge, and a word that fits the
+                        # template can be completed from the next node:
+                        # continue with it, if the budget allows
+                        if not allowance:
+                            allowance = budget.grant()
+                            if not allowance:
+                                return
+                        allowance -= 1
+                        stack.append((edges_for(nextnode, len(m), blanks), m, len(undo), bp))
+                        descending = True
+                        break
+                if not descending:
+                    stack.pop()
+        finally:
+            # Return the nodes that were granted but not entered
+            if budget is not None:
+                budget.refund(allowance)
+
+    def _grow(self, root):
+        """ Specialized navigation loop for a GaddagNavigator, generating
+            (start, word, blanks) tuples as they are found """
+        nav = self._nav
+        squares = nav._squares
+        lent = nav._lent
+        anchor = nav._anchor
+        leftmost = nav._leftmost
+        minlen = nav._minlen
+        viable = nav.viable
+        sep = GADDAG_SEPARATOR
+        coding = Alphabet.full_order
+        code = _LETTER_CODE
+        # Whether a word can end at the anchor, and whether it can extend to the right of it
+        ends_at_anchor = nav._may_end(anchor + 1)
+        rightwards = anchor + 1 < lent
+        # The rack is handled as in _permute(); only the empty squares
+        # take tiles from it
+        counts = list(nav._counts)
+        blanks = nav._blanks
+        rack_codes = nav._codes
+        nonletter = nav._nonletter
+        undo = []
+        take = undo.append
+        put_back = undo.pop
+        budget = self._budget
+        allowance = sys.maxsize if budget is None else 0
+
+        bits = _LETTER_BITS
+        maskable = nav._maskable
+        checks = nav._checks
+        allowed = nav._allowed
+
+        def edges_for(node, pos, leftward, start, blanks):
+            """ Return the edges of the node that can be entered when the next
+                square to fill is pos, growing the word in the given direction """
+            # The separator can be entered when growing leftwards, if the word can start
+            # at the current start square and there are squares right of the anchor
+            turn = leftward and rightwards and (start == 0 or squares[start - 1] is None)
+            if (pos < leftmost) if leftward else (pos >= lent):
+                # No more squares in this direction
+                edge = node.edge(sep) if turn else None
+                return iter(() if edge is None else (edge,))
+            square = squares[pos]
+            if square is not None:
+                # The letter on the board, or the separator
+                edges = [node.edge(square)]
+                if turn:
+                    edges.append(node.edge(sep))
+                return iter([edge for edge in edges if edge is not None])
+            check = checks[pos]
+            if blanks:
+                if check is not None:
+                    # A blank can be any letter that the cross-check allows
+                    return iter(node.matching_edges(allowed[pos] + sep if turn else allowed[pos]))
+                edges = node.edge_list
+                if not turn and edges and edges[-1][0][0] == sep:
+                    # The separator edge comes last
+                    edges = edges[:-1]
+                return iter(edges)
+            letters = []
+            avail = 0
+            for ix in rack_codes:
+                if counts[ix] and (check is None or check & bits[ix]):
+                    letters.append(coding[ix])
+                    avail |= bits[ix]
+            if turn:
+                letters.append(sep)
+            elif not letters or (maskable and not (node.mask & avail)):
+                return iter(())
+            return iter(node.matching_edges(letters))
+
+        # Each stack frame holds the edges to visit from a node, the path so far,
+        # the length of the undo list when the node was entered, the next square
+        # to fill, whether the word is growing leftwards, its first square so far,
+        # and a bit pattern of the squares filled by blanks
+        stack = [(edges_for(root, anchor, True, anchor + 1, blanks), u'', 0, anchor, True, anchor + 1, 0)]
+        try:
+            while stack:
+                edges, matched, mark, pos, leftward, start, blankpos = stack[-1]
+                descending = False
+                for prefix, nextnode in edges:
+                    # Put back the tiles taken by the previous edge from this node
+                    while len(undo) > mark:
+                        ix = put_back()
+                        if ix < 0:
+                            blanks += 1
+                        else:
+                            counts[ix] += 1
+                    lenp = len(prefix)
+                    m = matched
+                    p = pos
+                    lw = leftward
+                    st = start
+                    bp = blankpos
+                    j = 0
+                    while j < lenp:
+                        c = prefix[j]
+                        if c == sep:
+                            # Turn around and continue rightwards from the anchor
+                            if not lw or not rightwards or not (st == 0 or squares[st - 1] is None):
+                                break
+                            lw = False
+                            p = anchor + 1
+                        else:
+                            if (p < leftmost) if lw else (p >= lent):
+                                # Out of squares
+                                break
+                            square = squares[p]
+                            if square is not None:
+                                if c != square:
+                                    break
+                            else:
+                                ix = code.get(c, nonletter)
+                                check = checks[p]
+                                if check is not None and not (check & bits[ix]):
+                                    # The letter would not form a valid cross word
+                                    break
+                                if counts[ix]:
+                                    counts[ix] -= 1
+                                    take(ix)
+                                elif blanks:
+                                    blanks -= 1
+                                    take(-1)
+                                    bp |= 1 << p
+                                else:
+                                    # No rack tile for this prefix letter
+                                    break
+                            if lw:
+                                st = p
+                                p -= 1
+                            else:
+                                p += 1
+                        m += c
+                        j += 1
+                        if j < lenp and prefix[j] == u'|':
+                            j += 1
+                            final = True
+                        else:
+                            final = (j >= lenp) and ((nextnode is None) or nextnode.final)
+                        if final:
+                            # A complete path: does the word fit on the line?
+                            if lw:
+                                end = anchor + 1
+                                fits = ends_at_anchor and (st == 0 or squares[st - 1] is None)
+                            else:
+                                end = p
+                                fits = p == lent or squares[p] is None
+                            if fits and end - st >= minlen:
+                                if lw:
+                                    word = m[::-1]
+                                else:
+                                    left, right = m.split(sep)
+                                    word = left[::-1] + right
+                                yield (st, word, tuple(i - st for i in range(st, end) if bp >> i & 1) if bp else ())
+                    if j >= lenp and nextnode is not None and viable(nextnode, p, lw):
+                        # Gone through the entire edge, and a path from the next
+                        # node can fit on the line: continue with it, if the budget allows
+                        if not allowance:
+                            allowance = budget.grant()
+                            if not allowance:
+                                return
+                        allowance -= 1
+                        stack.append((edges_for(nextnode, p, lw, st, blanks), m, len(undo), p, lw, st, bp))
+                        descending = True
+                        break
+                if not descending:
+                    stack.pop()
+        finally:
+            # Return the nodes that were granted but not entered
+            if budget is not None:
+                budget.refund(allowance)
+
+    def _combine(self, root):
+        """ Specialized navigation loop for a CombinationNavigator, generating
+            (word, letter) tuples in the order in which they are found """
+        nav = self._nav
+        minlen = nav._minlen
+        coding = Alphabet.full_order
+        code = _LETTER_CODE
+        # The rack is handled as in _permute(), with the additional letter
+        # noted as -2 in the undo list
+        counts = list(nav._counts)
+        blanks = nav._blanks
+        extra = 1
+        added = None
+        rack_codes = nav._codes
+        nonletter = nav._nonletter
+        tiles = nav._tiles
+        undo = []
+        take = undo.append
+        put_back = undo.pop
+
+        budget = self._budget
+        allowance = sys.maxsize if budget is None else 0
+
+        bits = _LETTER_BITS
+        maskable = all(bits[ix] for ix in rack_codes)
+
+        def edges_for(node, wild):
+            """ Return the edges of the node that can be entered with the rack """
+            if wild:
+                return iter(node.edge_list)
+            letters = []
+            avail = 0
+            for ix in rack_codes:
+                if counts[ix]:
+                    letters.append(coding[ix])
+                    avail |= bits[ix]
+            if maskable and not (node.mask & avail):
+                return iter(())
+            return iter(node.matching_edges(letters))
+
+        def completes(node, left):
+            """ Returns True if a word using all the remaining rack tiles
+                plus at most one more letter could be completed from the node """
+            if not (node.minlen <= left + extra <= node.maxlen):
+                return False
+            if not maskable:
+                return True
+            # All the remaining rack letters must occur in the subgraph
+            need = 0
+            for ix in rack_codes:
+                if counts[ix]:
+                    need |= bits[ix]
+            return (node.mask & need) == need
+
+        stack = [(edges_for(root, True), u'', 0)]
+        try:
+            while stack:
+                edges, matched, mark = stack[-1]
+                descending = False
+                for prefix, nextnode in edges:
+                    # Put back the letters taken by the previous edge from this node
+                    while len(undo) > mark:
+                        ix = put_back()
+                        if ix == -2:
+                            extra = 1
+                        elif ix < 0:
+                            blanks += 1
+                        else:
+                            counts[ix] += 1
+                    lenp = len(prefix)
+                    # Number of rack tiles left
+                    left = tiles - mark + 1 - extra
+                    m = matched
+                    j = 0
+                    while j < lenp:
+                        c = prefix[j]
+                        ix = code.get(c, nonletter)
+                        if left and counts[ix]:
+                            counts[ix] -= 1
+                            take(ix)
+                            left -= 1
+                        elif left and blanks:
+                            blanks -= 1
+                            take(-1)
+                            left -= 1
+                        elif extra:
+                            # Use the additional letter, which is thereby determined
+                            extra = 0
+                            take(-2)
+                            added = c
+                        else:
+                            break
+                        m += c
+                        j += 1
+                        if j < lenp and prefix[j] == u'|':
+                            j += 1
+                            final = True
+                        else:
+                            final = (j >= lenp) and ((nextnode is None) or nextnode.final)
+                        if final:
+                            if extra:
+                                if len(m) >= minlen:
+                                    yield (m, None)
+                            elif not left:
+                                yield (m, added)
+                    if j >= lenp and nextnode is not None:
+                        # Can a combination be completed from the next node?
+                        combine = (left or extra) and completes(nextnode, left)
+                        if extra:
+                            # Either a permutation or a combination is possible
+                            descend = combine or (left and nextnode.minlen <= left and
+                                len(m) + min(left, nextnode.maxlen) >= minlen)
+                        else:
+                            # Only a combination, using all the remaining tiles
+                            descend = combine
+                            combine = False
+                        if descend:
+                            # If no combination is possible, only edges that can be
+                            # entered with tiles from the rack need to be considered
+                            if not allowance:
+                                allowance = budget.grant()
+                                if not allowance:
+                                    return
+                            allowance -= 1
+                            stack.append((edges_for(nextnode, blanks or combine), m, len(undo)))
+                            descending = True
+                            break
+                if not descending:
+                    stack.pop()
+        finally:
+            # Return the nodes that were granted but not entered
+            if budget is not None:
+                budget.refund(allowance)
 
     def go(self, root):
         """ Perform the navigation using the given navigator """
@@ -344,13 +2529,67 @@ class Navigation:
             return
         # The ship is ready to go
         if self._nav.accepting():
-            # Leave shore and navigate the open seas
-            self._navigate_from_node(root, u'')
+            # Leave shore and navigate the open seas, using a specialized
+            # loop if one is available for this type of navigator
+            cls = self._nav.__class__
+            if cls is FindNavigator:
+                self._find(root)
+            elif cls is MatchNavigator:
+                self._nav._result.extend(self._match(root))
+            elif cls is PatternNavigator:
+                self._nav._result.extend(self._pattern(root))
+            elif cls is PermutationNavigator:
+                self._nav._result.extend(self._permute(root))
+            elif cls is CombinationNavigator:
+                self._nav._result.extend(self._combine(root))
+            elif cls is PlacementNavigator:
+                self._nav._result.extend(self._place(root))
+            elif cls is GaddagNavigator:
+                self._nav._result.extend(self._grow(root))
+            else:
+                self._navigate_from_node(root, u'')
         self._nav.done()
 
+    @staticmethod
+    def _positioned(after_codes, i, c):
+        """ Compare a letter at index i of a path through the graph with the word
+            to start after, given as alphabet indices, when the letters before
+            index i are the same in both. Returns a tuple (onpath, before), where
+            onpath is True if the path is still a prefix of the word, and before
+            is True if the path, and all words along it, precede the word. """
+        if i >= len(after_codes):
+            # The path extends the word, and thus comes after it
+            return False, False
+        a = after_codes[i]
+        return c == a, c < a
+
+    def iterate(self, root, after = None):
+        """ Return a generator of the words found by a MatchNavigator, a PatternNavigator
+            or a PermutationNavigator, in the order in which they are found.
+            The navigation proceeds only as far as the generator is consumed,
+            and done() is not called. As the edges of each node are in
+            alphabetical order, the words are generated in that order too.
+            If after is given, the navigation starts right after that word,
+            or path through the graph: the edges before it are skipped at each
+            node along the path, and no words up to and including it are generated. """
+        cls = self._nav.__class__
+        if cls is MatchNavigator:
+            words = self._match
+        elif cls is PatternNavigator:
+            words = self._pattern
+        elif cls is PermutationNavigator:
+            words = self._permute
+        else:
+            raise ValueError("Only MatchNavigator, PatternNavigator and PermutationNavigator can be iterated")
+        if root is None or not self._nav.accepting():
+            return iter(())
+        return words(root, after)
+
     def resume(self, prefix, nextnode, matched):
         """ Resume navigation from a previously saved state """
-        self._navigate_from_edge(prefix, nextnode, matched)
+        matched = self._navigate_from_edge(prefix, nextnode, matched)
+        if matched is not None and (not self._filtering or self._nav.accepts_node(nextnode)):
+            self._navigate_from_node(nextnode, matched)
 
 
 class FindNavigator:
@@ -409,54 +2648,613 @@ class PermutationNavigator:
         to find all permutations of a rack
     """
 
-    def __init__(self, rack, minlen = 0):
+    def __init__(self, rack, minlen = 0, maxlen = None, scored = False):
         self._rack = rack
+        # The rack is represented as a vector of letter counts,
+        # indexed by position in the alphabet, and a count of blanks.
+        # The last slot is always zero and stands for letters outside the alphabet.
+        self._nonletter = len(Alphabet.full_order)
+        self._counts = [0] * (self._nonletter + 1)
+        self._blanks = 0
+        for c in rack:
+            if c == u'?':
+                self._blanks += 1
+            elif c in _LETTER_CODE:
+                self._counts[_LETTER_CODE[c]] += 1
+        # The distinct letters in the rack, as alphabet indices
+        self._codes = [ix for ix, cnt in enumerate(self._counts) if cnt]
+        # Node bit patterns can only be used for pruning if all rack letters have a bit
+        self._maskable = all(_LETTER_BITS[ix] for ix in self._codes)
+        # Total number of tiles in the rack
+        self._tiles = len(rack)
+        # Number of tiles left in the rack during navigation
+        self._left = self._tiles
+        # Letters taken from the rack along the current path, as alphabet indices,
+        # with -1 for a blank, so that they can be put back when leaving edges
+        self._undo = []
+        # Positions in the undo list where each edge on the current path starts
         self._stack = []
         self._result = []
         self._minlen = minlen
+        # The longest permutation cannot exceed the number of tiles in the rack
+        self._maxlen = self._tiles if maxlen is None else min(maxlen, self._tiles)
+        # If scored, the result contains (word, score, blanks) tuples
+        # instead of words; see DawgDictionary.find_permutations()
+        self._scored = scored
+        self._score = 0
+        self._blankpos = []
 
     def push_edge(self, firstchar):
         """ Returns True if the edge should be entered or False if not """
         # Follow all edges that match a letter in the rack
         # (which can be '?', matching all edges)
-        if not ((firstchar in self._rack) or (u'?' in self._rack)):
+        if not self._blanks and not self._counts[_LETTER_CODE.get(firstchar, self._nonletter)]:
             return False
-        # Fit: save our rack and move into the edge
-        self._stack.append(self._rack)
+        # Fit: note where we are and move into the edge
+        self._stack.append(len(self._undo))
         return True
 
     def accepting(self):
         """ Returns False if the navigator does not want more characters """
         # Continue as long as there is something left on the rack
-        return bool(self._rack)
+        # and the maximum length has not been reached
+        return self._tiles - self._left < self._maxlen
 
     def accepts(self, newchar):
         """ Returns True if the navigator will accept the new character """
-        exactmatch = newchar in self._rack
-        if (not exactmatch) and (u'?' not in self._rack):
+        ix = _LETTER_CODE.get(newchar, self._nonletter)
+        if self._counts[ix]:
+            # Exact match: remove the letter from the rack
+            self._counts[ix] -= 1
+            self._undo.append(ix)
+            self._score += _LETTER_SCORES[ix]
+        elif self._blanks:
+            # Use a blank for the letter, noting its position in the word
+            self._blanks -= 1
+            self._undo.append(-1)
+            self._blankpos.append(self._tiles - self._left)
+        else:
             # Can't continue with this prefix - we no longer have rack letters matching it
             return False
-        # We're fine with this: accept the character and remove from the rack
-        if exactmatch:
-            self._rack = self._rack.replace(newchar, u'', 1)
-        else:
-            self._rack = self._rack.replace(u'?', u'', 1)
+        self._left -= 1
         return True
 
     def accept(self, matched, final):
         """ Called to inform the navigator of a match and whether it is a final word """
         if final and len(matched) >= self._minlen:
-            self._result.append(matched)
+            if self._scored:
+                self._result.append((matched, self._score, tuple(self._blankpos)))
+            else:
+                self._result.append(matched)
+
+    def accepts_node(self, node):
+        """ Returns False if no continuation from the node can be made with the rack """
+        # Check whether a word of an acceptable length can be completed from the node
+        used = self._tiles - self._left
+        room = self._maxlen - used
+        if node.minlen > room or used + min(room, node.maxlen) < self._minlen:
+            return False
+        if self._blanks or not self._maskable:
+            return True
+        avail = 0
+        for ix in self._codes:
+            if self._counts[ix]:
+                avail |= _LETTER_BITS[ix]
+        return bool(node.mask & avail)
 
     def pop_edge(self):
         """ Called when leaving an edge that has been navigated """
-        self._rack = self._stack.pop()
+        # Put back the letters taken from the rack since the edge was entered
+        mark = self._stack.pop()
+        undo = self._undo
+        while len(undo) > mark:
+            ix = undo.pop()
+            if ix < 0:
+                self._blanks += 1
+                self._blankpos.pop()
+            else:
+                self._counts[ix] += 1
+                self._score -= _LETTER_SCORES[ix]
+            self._left += 1
         # We need to visit all outgoing edges, so return True
         return True
 
     def done(self):
         """ Called when the whole navigation is done """
-        self._result.sort(key = lambda x: (-len(x), Alphabet.sortkey(x)))
+        # The graph is traversed in alphabetical order, so the words only
+        # need to be grouped by length
+        if self._scored:
+            self._result = _longest_first(self._result, lambda x: len(x[0]))
+        else:
+            self._result = _longest_first(self._result, len)
+
+    def result(self):
+        return self._result
+
+
+class CombinationNavigator(PermutationNavigator):
+
+    """ A navigation class to be used with DawgDictionary.navigate()
+        to find, in a single traversal, all permutations of a rack as well as
+        all words that can be formed from the whole rack plus one additional letter.
+
+        The additional letter is an extra wildcard that is only used when the
+        rack itself has no tile for a letter. The letter that it stands for is
+        recorded at the point where it is consumed, and once it has been used,
+        only paths that can use up all the rack tiles are followed.
+
+        The result is a list of (word, letter) tuples, where letter is None for
+        permutations of the rack and the additional letter for combinations.
+    """
+
+    def __init__(self, rack, minlen = 0):
+        PermutationNavigator.__init__(self, rack, minlen)
+        # 1 while the additional letter is still available, 0 once it has been used
+        self._extra = 1
+        self._added = None
+
+    def push_edge(self, firstchar):
+        """ Returns True if the edge should be entered or False if not """
+        if self._extra:
+            # The additional letter can match any edge
+            self._stack.append(len(self._undo))
+            return True
+        return PermutationNavigator.push_edge(self, firstchar)
+
+    def accepting(self):
+        """ Returns False if the navigator does not want more characters """
+        return self._left > 0 or self._extra > 0
+
+    def accepts(self, newchar):
+        """ Returns True if the navigator will accept the new character """
+        if self._left and PermutationNavigator.accepts(self, newchar):
+            return True
+        if not self._extra:
+            return False
+        # Use the additional letter, noting which letter it stands for
+        self._extra = 0
+        self._added = newchar
+        self._undo.append(-2)
+        return True
+
+    def accept(self, matched, final):
+        """ Called to inform the navigator of a match and whether it is a final word """
+        if final:
+            if self._extra:
+                if len(matched) >= self._minlen:
+                    self._result.append((matched, None))
+            elif not self._left:
+                # The whole rack plus the additional letter
+                self._result.append((matched, self._added))
+
+    def _completes(self, node):
+        """ Returns True if a word using all the remaining rack tiles, plus the
+            additional letter if still available, could be completed from the node """
+        if not (node.minlen <= self._left + self._extra <= node.maxlen):
+            return False
+        if not self._maskable:
+            return True
+        # All the remaining rack letters must occur in the subgraph
+        need = 0
+        for ix in self._codes:
+            if self._counts[ix]:
+                need |= _LETTER_BITS[ix]
+        return (node.mask & need) == need
+
+    def accepts_node(self, node):
+        """ Returns False if no continuation from the node can be made """
+        if self._completes(node):
+            # A combination can be completed from the node
+            return True
+        # Otherwise, only a permutation that does not use the additional letter
+        return self._extra > 0 and self._left > 0 and PermutationNavigator.accepts_node(self, node)
+
+    def pop_edge(self):
+        """ Called when leaving an edge that has been navigated """
+        mark = self._stack[-1]
+        undo = self._undo
+        if -2 in undo[mark:]:
+            # Put back the additional letter
+            undo.remove(-2)
+            self._extra = 1
+        return PermutationNavigator.pop_edge(self)
+
+    def done(self):
+        """ Called when the whole navigation is done """
+        self._result = _longest_first(self._result, lambda x: len(x[0]))
+
+
+class PlacementNavigator:
+
+    """ A navigation class to be used with DawgDictionary.navigate()
+        to find all words that can be placed on a line of the board,
+        starting at the first square of a template.
+
+        The template is a string with a character for each square, from
+        the starting square onwards: a letter for a tile that is already
+        on the board, or '.' for an empty square. The empty squares
+        are filled with tiles from the rack, which may contain blanks ('?').
+        A word must use at least one tile from the rack, and it cannot
+        end right before a tile on the board, as the tile would then
+        extend it.
+
+        Optionally, checks is a list with a cross-check for each square:
+        a bit pattern as in Alphabet.bit of the letters that may be placed
+        on the square, typically those that form valid words with the tiles
+        above and below it, or None if any letter may be placed there.
+
+        The result is a list of (word, blanks) tuples in alphabetical order,
+        where blanks is a tuple of the positions in the word that are filled
+        by blanks. Letters are taken from the rack in preference to blanks,
+        so each word occurs only once.
+    """
+
+    def __init__(self, template, rack, minlen = 0, checks = None):
+        self._template = template
+        self._lent = len(template)
+        # The letter on each square, or None for an empty square
+        self._squares = _template_squares(template)
+        # The cross-check of each square, and the letters that it allows
+        self._checks = _check_list(self._squares, checks)
+        self._allowed = [_check_letters(check) for check in self._checks]
+        # The rack is represented as in PermutationNavigator
+        self._nonletter = len(Alphabet.full_order)
+        self._counts = [0] * (self._nonletter + 1)
+        self._blanks = 0
+        for c in rack:
+            if c == u'?':
+                self._blanks += 1
+            elif c in _LETTER_CODE:
+                self._counts[_LETTER_CODE[c]] += 1
+        self._codes = [ix for ix, cnt in enumerate(self._counts) if cnt]
+        self._maskable = all(_LETTER_BITS[ix] for ix in self._codes)
+        tiles = len(rack)
+        # A bit pattern of the word lengths that fit the template: bit n is set if
+        # a word of n letters ends before an empty square or the end of the line,
+        # uses at least one rack tile, and needs no more tiles than there are.
+        # No word can cover an empty square whose cross-check allows no letter.
+        self._ends = 0
+        empty = 0
+        for n in range(1, self._lent + 1):
+            if self._squares[n - 1] is None:
+                if self._checks[n - 1] == 0:
+                    break
+                empty += 1
+            if empty > tiles:
+                break
+            if empty and n >= minlen and (n == self._lent or self._squares[n] is None):
+                self._ends |= 1 << n
+        # For each pair of positions i <= n, a bit pattern of the letters
+        # on the board from square i up to, but not including, square n
+        self._required = []
+        for i in range(self._lent + 1):
+            row = [0] * (self._lent + 1)
+            for n in range(i + 1, self._lent + 1):
+                row[n] = row[n - 1] | Alphabet.letter_bit.get(self._squares[n - 1], 0)
+            self._required.append(row)
+        # Current position in the template, and the positions of blanks in the word
+        self._len = 0
+        self._blankpos = []
+        # Rack tiles taken along the current path, with -1 for a blank,
+        # and the state at the start of each edge on the path
+        self._undo = []
+        self._stack = []
+        self._result = []
+
+    def viable(self, node, i):
+        """ Returns True if a word that fits the template could be completed
+            from the node, at position i in the template """
+        lo = i + node.minlen
+        hi = min(i + node.maxlen, self._lent)
+        if lo > hi:
+            return False
+        window = (self._ends >> lo) & ((1 << (hi - lo + 1)) - 1)
+        if not window:
+            return False
+        # The letters on the board up to the shortest fitting word must all occur
+        # somewhere in the subgraph
+        end = lo + (window & -window).bit_length() - 1
+        required = self._required[i][end]
+        return (node.mask & required) == required
+
+    def push_edge(self, firstchar):
+        """ Returns True if the edge should be entered or False if not """
+        if not self.accepting():
+            return False
+        square = self._squares[self._len]
+        if square is not None:
+            # Only the edge with the letter on the board
+            if firstchar != square:
+                return False
+        else:
+            ix = _LETTER_CODE.get(firstchar, self._nonletter)
+            check = self._checks[self._len]
+            if check is not None and not (check & _LETTER_BITS[ix]):
+                return False
+            if not self._blanks and not self._counts[ix]:
+                return False
+        self._stack.append((len(self._undo), self._len))
+        return True
+
+    def accepting(self):
+        """ Returns False if the navigator does not want more characters """
+        return self._len < self._lent
+
+    def accepts(self, newchar):
+        """ Returns True if the navigator will accept the new character """
+        square = self._squares[self._len]
+        if square is not None:
+            if newchar != square:
+                return False
+        else:
+            ix = _LETTER_CODE.get(newchar, self._nonletter)
+            check = self._checks[self._len]
+            if check is not None and not (check & _LETTER_BITS[ix]):
+                return False
+            if self._counts[ix]:
+                self._counts[ix] -= 1
+                self._undo.append(ix)
+            elif self._blanks:
+                self._blanks -= 1
+                self._undo.append(-1)
+                self._blankpos.append(self._len)
+            else:
+                return False
+        self._len += 1
+        return True
+
+    def accept(self, matched, final):
+        """ Called to inform the navigator of a match and whether it is a final word """
+        if final and (self._ends >> self._len) & 1:
+            self._result.append((matched, tuple(self._blankpos)))
+
+    def accepts_node(self, node):
+        """ Returns False if no word fitting the template can be completed from the node """
+        if not self.viable(node, self._len):
+            return False
+        if self._squares[self._len] is not None or self._blanks or not self._maskable:
+            return True
+        # The next square is empty: some remaining rack letter that the
+        # cross-check allows must occur in the subgraph
+        check = self._checks[self._len]
+        avail = 0
+        for ix in self._codes:
+            if self._counts[ix]:
+                avail |= _LETTER_BITS[ix]
+        if check is not None:
+            avail &= check
+        return bool(node.mask & avail)
+
+    def pop_edge(self):
+        """ Called when leaving an edge that has been navigated """
+        mark, self._len = self._stack.pop()
+        undo = self._undo
+        while len(undo) > mark:
+            ix = undo.pop()
+            if ix < 0:
+                self._blanks += 1
+                self._blankpos.pop()
+            else:
+                self._counts[ix] += 1
+        return True
+
+    def done(self):
+        """ Called when the whole navigation is done """
+        # The graph is traversed in alphabetical order, so the
+        # result is already sorted
+        pass
+
+    def result(self):
+        return self._result
+
+
+class GaddagNavigator:
+
+    """ A navigation class to be used with GaddagDictionary.navigate()
+        to find all words on a line of the board that cover an anchor square,
+        growing them outwards from the anchor.
+
+        The template and rack are as for PlacementNavigator. The anchor is
+        the index of an empty square, which is filled first. The word then
+        grows leftwards, square by square, but not beyond the leftmost square
+        given, and then rightwards from the anchor once the GADDAG separator
+        is passed. Tiles on the board are taken as they are, and the empty
+        squares are filled from the rack.
+
+        Optional cross-checks for the squares are as for PlacementNavigator.
+
+        The result is a list of (start, word, blanks) tuples, where start is
+        the index of the first square of the word and blanks is a tuple of
+        the positions in the word that are filled by blanks.
+    """
+
+    def __init__(self, template, rack, anchor, leftmost = 0, minlen = 0, checks = None):
+        self._squares = _template_squares(template)
+        self._lent = len(template)
+        self._checks = _check_list(self._squares, checks)
+        self._allowed = [_check_letters(check) for check in self._checks]
+        if not 0 <= anchor < self._lent or self._squares[anchor] is not None:
+            raise ValueError(u"Anchor {0} is not an empty square".format(anchor))
+        self._anchor = anchor
+        self._leftmost = leftmost
+        self._minlen = minlen
+        # For each square, the number of consecutive tiles on the board
+        # starting at it and ending at it, and bit patterns of their letters.
+        # A word that reaches a tile must cover its whole run of tiles.
+        lent = self._lent
+        self._run_len = [0] * (lent + 1)
+        self._run_bits = [0] * (lent + 1)
+        for i in range(lent - 1, -1, -1):
+            if self._squares[i] is not None:
+                self._run_len[i] = self._run_len[i + 1] + 1
+                self._run_bits[i] = self._run_bits[i + 1] | Alphabet.letter_bit.get(self._squares[i], 0)
+        self._lrun_len = [0] * lent
+        self._lrun_bits = [0] * lent
+        for i in range(lent):
+            if self._squares[i] is not None:
+                self._lrun_len[i] = (self._lrun_len[i - 1] if i else 0) + 1
+                self._lrun_bits[i] = (self._lrun_bits[i - 1] if i else 0) | Alphabet.letter_bit.get(self._squares[i], 0)
+        # The rack is represented as in PermutationNavigator
+        self._nonletter = len(Alphabet.full_order)
+        self._counts = [0] * (self._nonletter + 1)
+        self._blanks = 0
+        for c in rack:
+            if c == u'?':
+                self._blanks += 1
+            elif c in _LETTER_CODE:
+                self._counts[_LETTER_CODE[c]] += 1
+        self._codes = [ix for ix, cnt in enumerate(self._counts) if cnt]
+        self._maskable = all(_LETTER_BITS[ix] for ix in self._codes)
+        # The next square to fill, whether the word is still growing leftwards,
+        # and its first square so far
+        self._pos = anchor
+        self._leftward = True
+        self._start = anchor + 1
+        # Squares filled by blanks
+        self._blankpos = []
+        # Rack tiles taken along the current path, with -1 for a blank,
+        # and the state at the start of each edge on the path
+        self._undo = []
+        self._stack = []
+        self._result = []
+
+    def _may_start(self, start):
+        """ Returns True if a word can start at the given square """
+        return start == 0 or self._squares[start - 1] is None
+
+    def _may_end(self, end):
+        """ Returns True if a word can end right before the given square """
+        return end == self._lent or self._squares[end] is None
+
+    def viable(self, node, pos, leftward):
+        """ Returns True if a path from the node could fit on the line when the
+            next square to fill is pos. The path, including the separator, must
+            fit in the squares that are left, and it must be long enough to cover
+            the tiles that the word is bound to reach, whose letters must occur
+            in the subgraph. """
+        if leftward:
+            room = (pos + 1 - self._leftmost) + 1 + (self._lent - self._anchor - 1)
+            # The tiles right before the start of the word
+            need_len = self._lrun_len[pos] if pos >= 0 else 0
+            need = self._lrun_bits[pos] if pos >= 0 else 0
+            right = self._anchor + 1
+            if self._run_len[right]:
+                # The tiles right after the anchor, beyond the separator
+                need_len += 1 + self._run_len[right]
+                need |= self._run_bits[right]
+        else:
+            room = self._lent - pos
+            need_len = self._run_len[pos]
+            need = self._run_bits[pos]
+        return node.minlen <= room and node.maxlen >= need_len and (node.mask & need) == need
+
+    def push_edge(self, firstchar):
+        """ Returns True if the edge should be entered or False if not """
+        if firstchar == GADDAG_SEPARATOR:
+            if not self._leftward:
+                return False
+        elif self._leftward and self._pos < self._leftmost:
+            # Only the separator can follow
+            return False
+        elif not self._leftward and self._pos >= self._lent:
+            return False
+        else:
+            square = self._squares[self._pos]
+            if square is not None:
+                if firstchar != square:
+                    return False
+            else:
+                ix = _LETTER_CODE.get(firstchar, self._nonletter)
+                check = self._checks[self._pos]
+                if check is not None and not (check & _LETTER_BITS[ix]):
+                    return False
+                if not self._blanks and not self._counts[ix]:
+                    return False
+        self._stack.append((len(self._undo), len(self._blankpos),
+            self._pos, self._leftward, self._start))
+        return True
+
+    def accepting(self):
+        """ Returns False if the navigator does not want more characters """
+        return self._leftward or self._pos < self._lent
+
+    def accepts(self, newchar):
+        """ Returns True if the navigator will accept the new character """
+        if newchar == GADDAG_SEPARATOR:
+            # Turn around and continue rightwards from the anchor
+            if not self._leftward or not self._may_start(self._start) or self._anchor + 1 >= self._lent:
+                return False
+            self._leftward = False
+            self._pos = self._anchor + 1
+            return True
+        pos = self._pos
+        if (pos < self._leftmost) if self._leftward else (pos >= self._lent):
+            return False
+        square = self._squares[pos]
+        if square is not None:
+            if newchar != square:
+                return False
+        else:
+            ix = _LETTER_CODE.get(newchar, self._nonletter)
+            check = self._checks[pos]
+            if check is not None and not (check & _LETTER_BITS[ix]):
+                return False
+            if self._counts[ix]:
+                self._counts[ix] -= 1
+                self._undo.append(ix)
+            elif self._blanks:
+                self._blanks -= 1
+                self._undo.append(-1)
+                self._blankpos.append(pos)
+            else:
+                return False
+        if self._leftward:
+            self._start = pos
+            self._pos = pos - 1
+        else:
+            self._pos = pos + 1
+        return True
+
+    def accept(self, matched, final):
+        """ Called to inform the navigator of a match and whether it is a final word """
+        if not final or matched.endswith(GADDAG_SEPARATOR):
+            return
+        start = self._start
+        if self._leftward:
+            # The path is the whole word reversed, ending at the anchor
+            end = self._anchor + 1
+            if not (self._may_start(start) and self._may_end(end)):
+                return
+            word = matched[::-1]
+        else:
+            end = self._pos
+            if not self._may_end(end):
+                return
+            left, right = matched.split(GADDAG_SEPARATOR)
+            word = left[::-1] + right
+        if end - start >= self._minlen:
+            self._result.append((start, word, tuple(i - start for i in sorted(self._blankpos))))
+
+    def accepts_node(self, node):
+        """ Returns False if the paths from the node do not fit on the line """
+        return self.viable(node, self._pos, self._leftward)
+
+    def pop_edge(self):
+        """ Called when leaving an edge that has been navigated """
+        mark, blanks, self._pos, self._leftward, self._start = self._stack.pop()
+        undo = self._undo
+        while len(undo) > mark:
+            ix = undo.pop()
+            if ix < 0:
+                self._blanks += 1
+            else:
+                self._counts[ix] += 1
+        del self._blankpos[blanks:]
+        return True
+
+    def done(self):
+        """ Called when the whole navigation is done """
+        pass
 
     def result(self):
         return self._result
@@ -476,7 +3274,13 @@ class MatchNavigator:
         self._wildcard = (self._chmatch == u'?')
         self._stack = []
         self._result = []
+        # The result is sorted in any case; see DawgDictionary.find_matches()
         self._sort = sort
+        # For each position in the pattern, a bit pattern of the
+        # fixed letters from that position onwards
+        self._required = [0] * (self._lenp + 1)
+        for i in range(self._lenp - 1, -1, -1):
+            self._required[i] = self._required[i + 1] | Alphabet.letter_bit.get(pattern[i], 0)
 
     def push_edge(self, firstchar):
         """ Returns True if the edge should be entered or False if not """
@@ -510,6 +3314,16 @@ class MatchNavigator:
             # (Note that this could be relaxed to also return partial (shorter) pattern matches)
             self._result.append(matched)
 
+    def accepts_node(self, node):
+        """ Returns False if the rest of the pattern cannot be matched from the node """
+        # A word of exactly the pattern length must be possible from the node
+        remaining = self._lenp - self._index
+        if not (node.minlen <= remaining <= node.maxlen):
+            return False
+        # All remaining fixed letters must occur somewhere in the subgraph
+        required = self._required[self._index]
+        return (node.mask & required) == required
+
     def pop_edge(self):
         """ Called when leaving an edge that has been navigated """
         self._index, self._chmatch, self._wildcard = self._stack.pop()
@@ -518,9 +3332,307 @@ class MatchNavigator:
 
     def done(self):
         """ Called when the whole navigation is done """
-        if self._sort:
-            self._result.sort(key = Alphabet.sortkey)
+        # The graph is traversed in alphabetical order, so the
+        # result is already sorted
+        pass
 
     def result(self):
         return self._result
 
+
+class _CompiledPattern:
+
+    """ A pattern in the extended pattern language, compiled into an automaton
+        that is run in step with the navigation of the graph.
+
+        The pattern is a sequence of elements, each of which matches one letter,
+        except '*' which matches any number of letters, including none:
+
+            a       the letter a
+            ?       any letter
+            [abc]   any of the letters a, b and c
+            [^abc]  any letter except a, b and c
+            *       any sequence of letters
+
+        The pattern matches whole words, unless it starts with '^' or ends
+        with '$', in which case only the start or the end of the word,
+        respectively, is anchored: '^ab' is the same as 'ab*' and 'ab$' the
+        same as '*ab'. A suffix of the form {m,n}, {m,}, {,n} or {m} limits
+        the length of the words matched.
+
+        The automaton is a nondeterministic one with a state for each position
+        in the element sequence. Sets of its states, represented as bit patterns,
+        form the states of an equivalent deterministic automaton, whose transitions
+        are calculated as they are needed and kept for subsequent navigations.
+    """
+
+    # Compiled patterns, cached by pattern string, and their maximum number
+    _cache = OrderedDict()
+    _CACHE_SIZE = 256
+    _lock = threading.Lock()
+
+    # Bit pattern of all letters, by their alphabet index
+    _ALL = (1 << len(Alphabet.full_order)) - 1
+
+    @staticmethod
+    def get(pattern):
+        """ Return the compiled form of a pattern, compiling it if it is not in the cache """
+        with _CompiledPattern._lock:
+            compiled = _CompiledPattern._cache.pop(pattern, None)
+            if compiled is None:
+                compiled = _CompiledPattern(pattern)
+            # Keep the most recently used patterns at the end
+            _CompiledPattern._cache[pattern] = compiled
+            if len(_CompiledPattern._cache) > _CompiledPattern._CACHE_SIZE:
+                _CompiledPattern._cache.popitem(last = False)
+            return compiled
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.minlen = 0
+        self.maxlen = None
+        # Each element is a bit pattern of the letters that it matches,
+        # or None for '*'
+        self._elements = elements = self._parse(pattern)
+        n = len(elements)
+        # The final state, reached when the whole pattern has been matched
+        self._final_bit = 1 << n
+        # For each state, the states reachable from it without consuming a letter
+        self._closure = [0] * (n + 1)
+        for i in range(n, -1, -1):
+            self._closure[i] = (1 << i) | (self._closure[i + 1]
+                if i < n and elements[i] is None else 0)
+        # For each state, the number of letters required to reach the final state,
+        # the maximum number, or None if unbounded, and the bit pattern (as in
+        # Alphabet.bit) of the letters that must occur on the way
+        self._minrem = [0] * (n + 1)
+        self._maxrem = [0] * (n + 1)
+        self._required = [0] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            e = elements[i]
+            if e is None:
+                self._minrem[i] = self._minrem[i + 1]
+                self._maxrem[i] = None
+                self._required[i] = self._required[i + 1]
+            else:
+                self._minrem[i] = self._minrem[i + 1] + 1
+                self._maxrem[i] = None if self._maxrem[i + 1] is None else self._maxrem[i + 1] + 1
+                bit = 0
+                if e & (e - 1) == 0:
+                    # A single letter
+                    bit = _LETTER_BITS[e.bit_length() - 1]
+                self._required[i] = self._required[i + 1] | bit
+        self.start = self._closure[0]
+        # Transitions of the deterministic automaton, as a list of next states
+        # by letter index for each state, and information about each state
+        self._transitions = dict()
+        self._info = dict()
+
+    def _parse(self, pattern):
+        """ Parse a pattern into a list of elements, noting length limits """
+        text = pattern
+        if text.endswith(u'}'):
+            # Length limits
+            ix = text.rfind(u'{')
+            if ix < 0:
+                raise ValueError(u"Unmatched '}}' in pattern '{0}'".format(pattern))
+            limits = text[ix + 1:-1].split(u',')
+            text = text[0:ix]
+            try:
+                if len(limits) == 1:
+                    self.minlen = self.maxlen = int(limits[0])
+                elif len(limits) == 2:
+                    self.minlen = int(limits[0]) if limits[0] else 0
+                    self.maxlen = int(limits[1]) if limits[1] else None
+                else:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(u"Invalid length limits in pattern '{0}'".format(pattern))
+            if self.minlen < 0 or (self.maxlen is not None and self.minlen > self.maxlen):
+                raise ValueError(u"Invalid length limits in pattern '{0}'".format(pattern))
+        start_anchor = text.startswith(u'^')
+        if start_anchor:
+            text = text[1:]
+        end_anchor = text.endswith(u'$')
+        if end_anchor:
+            text = text[0:-1]
+        if not text:
+            raise ValueError(u"No elements in pattern '{0}'".format(pattern))
+        if start_anchor and not end_anchor:
+            # Only the start is anchored: the end is free
+            text += u'*'
+        elif end_anchor and not start_anchor:
+            # Only the end is anchored: the start is free
+            text = u'*' + text
+        elements = []
+        code = _LETTER_CODE
+        i = 0
+        while i < len(text):
+            c = text[i]
+            i += 1
+            if c == u'*':
+                if not elements or elements[-1] is not None:
+                    # Consecutive stars are the same as one
+                    elements.append(None)
+            elif c == u'?':
+                elements.append(_CompiledPattern._ALL)
+            elif c == u'[':
+                end = text.find(u']', i)
+                if end < 0:
+                    raise ValueError(u"Unmatched '[' in pattern '{0}'".format(pattern))
+                letters = text[i:end]
+                i = end + 1
+                negated = letters.startswith(u'^')
+                if negated:
+                    letters = letters[1:]
+                bits = 0
+                for ch in letters:
+                    if ch not in code:
+                        raise ValueError(u"Invalid letter '{0}' in pattern '{1}'".format(ch, pattern))
+                    bits |= 1 << code[ch]
+                if negated:
+                    bits = _CompiledPattern._ALL & ~bits
+                if not bits:
+                    raise ValueError(u"Empty letter set in pattern '{0}'".format(pattern))
+                elements.append(bits)
+            elif c in code:
+                elements.append(1 << code[c])
+            else:
+                raise ValueError(u"Invalid character '{0}' in pattern '{1}'".format(c, pattern))
+        return elements
+
+    def next_states(self, state):
+        """ Return a list of the states that follow the given state,
+            indexed by letter, with 0 for no match """
+        row = self._transitions.get(state)
+        if row is None:
+            elements = self._elements
+            closure = self._closure
+            row = [0] * (len(Alphabet.full_order) + 1)
+            for c in range(len(Alphabet.full_order)):
+                bit = 1 << c
+                target = 0
+                i = 0
+                s = state
+                while s:
+                    if s & 1 and i < len(elements):
+                        e = elements[i]
+                        if e is None:
+                            # A star matches the letter and remains active
+                            target |= closure[i]
+                        elif e & bit:
+                            target |= closure[i + 1]
+                    s >>= 1
+                    i += 1
+                row[c] = target
+            self._transitions[state] = row
+        return row
+
+    def info(self, state):
+        """ Return a tuple with information about a state: the minimum and maximum
+            number of letters to the final state (None if unbounded), the bit pattern
+            of the letters that must occur on the way, and the list of letters that
+            can come next, or None if any letter can """
+        info = self._info.get(state)
+        if info is None:
+            minrem = None
+            maxrem = 0
+            required = None
+            letters = 0
+            i = 0
+            s = state
+            while s:
+                if s & 1:
+                    minrem = self._minrem[i] if minrem is None else min(minrem, self._minrem[i])
+                    if maxrem is not None:
+                        maxrem = None if self._maxrem[i] is None else max(maxrem, self._maxrem[i])
+                    required = self._required[i] if required is None else (required & self._required[i])
+                    if i < len(self._elements):
+                        e = self._elements[i]
+                        letters |= _CompiledPattern._ALL if e is None else e
+                s >>= 1
+                i += 1
+            if letters == _CompiledPattern._ALL:
+                letters = None
+            else:
+                letters = [c for ix, c in enumerate(Alphabet.full_order) if letters & (1 << ix)]
+            info = (minrem, maxrem, required, letters)
+            self._info[state] = info
+        return info
+
+    def is_final(self, state):
+        """ Returns True if the whole pattern has been matched in the given state """
+        return bool(state & self._final_bit)
+
+    def viable(self, node, state, length):
+        """ Returns True if a word matching the pattern could be completed from
+            the node, in the given state and with the given number of letters so far """
+        minrem, maxrem, required, _ = self.info(state)
+        lo = max(node.minlen, minrem, self.minlen - length)
+        hi = node.maxlen
+        if maxrem is not None:
+            hi = min(hi, maxrem)
+        if self.maxlen is not None:
+            hi = min(hi, self.maxlen - length)
+        return lo <= hi and (node.mask & required) == required
+
+
+class PatternNavigator:
+
+    """ A navigation class to be used with DawgDictionary.navigate()
+        to find all words matching a pattern in the extended pattern
+        language; see _CompiledPattern
+    """
+
+    def __init__(self, pattern):
+        self._compiled = _CompiledPattern.get(pattern)
+        self._state = self._compiled.start
+        self._len = 0
+        self._stack = []
+        self._result = []
+
+    def push_edge(self, firstchar):
+        """ Returns True if the edge should be entered or False if not """
+        ix = _LETTER_CODE.get(firstchar)
+        if ix is None or not self._compiled.next_states(self._state)[ix]:
+            return False
+        self._stack.append((self._state, self._len))
+        return True
+
+    def accepting(self):
+        """ Returns False if the navigator does not want more characters """
+        maxlen = self._compiled.maxlen
+        return self._state != 0 and (maxlen is None or self._len < maxlen)
+
+    def accepts(self, newchar):
+        """ Returns True if the navigator will accept the new character """
+        ix = _LETTER_CODE.get(newchar)
+        state = 0 if ix is None else self._compiled.next_states(self._state)[ix]
+        if not state:
+            return False
+        self._state = state
+        self._len += 1
+        return True
+
+    def accept(self, matched, final):
+        """ Called to inform the navigator of a match and whether it is a final word """
+        if final and self._compiled.is_final(self._state) and self._len >= self._compiled.minlen:
+            self._result.append(matched)
+
+    def accepts_node(self, node):
+        """ Returns False if the rest of the pattern cannot be matched from the node """
+        return self._compiled.viable(node, self._state, self._len)
+
+    def pop_edge(self):
+        """ Called when leaving an edge that has been navigated """
+        self._state, self._len = self._stack.pop()
+        return True
+
+    def done(self):
+        """ Called when the whole navigation is done """
+        # The graph is traversed in alphabetical order, so the
+        # result is already sorted
+        pass
+
+    def result(self):
+        return self._result
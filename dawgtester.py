@@ -11,9 +11,20 @@
 import os
 import codecs
 import time
+import random
 
-from dawgdictionary import DawgDictionary
+from dawgdictionary import DawgDictionary, GaddagDictionary, Budget
 from languages import Alphabet
+from skraflboard import Board
+
+
+def _rss_kb():
+    """ Return the resident set size of this process in KB, or None if not available """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
 
 
 class DawgTester:
@@ -40,19 +51,53 @@ class DawgTester:
         print("Author: Vilhjalmur Thorsteinsson")
         print
 
-        self._dawg = DawgDictionary()
         fpath = os.path.abspath(os.path.join(relpath, fname + ".text.dawg"))
+
+        compact = DawgDictionary()
+        rss0 = _rss_kb()
+        t0 = time.time()
+        compact.load_compact(fpath)
+        t1 = time.time()
+        rss1 = _rss_kb()
+
+        print("Compact DAWG loaded in {0:.2f} seconds".format(t1 - t0))
+
+        self._dawg = DawgDictionary()
         t0 = time.time()
         self._dawg.load(fpath)
         t1 = time.time()
+        rss2 = _rss_kb()
 
         print("DAWG loaded in {0:.2f} seconds".format(t1 - t0))
 
+        if rss0 is not None:
+            print("Resident memory: compact graph {0} KB, node graph {1} KB"
+                .format(rss1 - rss0, rss2 - rss1))
+
+        sname = os.path.abspath(os.path.join(relpath, fname + ".dawg.snapshot"))
+        t0 = time.time()
+        compact.store_snapshot(sname, DawgDictionary.source_hash(fpath))
+        t1 = time.time()
+
+        print("DAWG snapshot file stored in {0:.2f} seconds".format(t1 - t0))
+
+        snapshot = DawgDictionary()
         t0 = time.time()
-        self._dawg.store_pickle(os.path.abspath(os.path.join(relpath, fname + ".dawg.pickle")))
+        snapshot.load_snapshot(sname, DawgDictionary.source_hash(fpath))
         t1 = time.time()
 
-        print("DAWG pickle file stored in {0:.2f} seconds".format(t1 - t0))
+        print("DAWG snapshot file loaded in {0:.4f} seconds".format(t1 - t0))
+
+        packed = DawgDictionary()
+        t0 = time.time()
+        packed.load_binary(os.path.abspath(os.path.join(relpath, fname + ".dawg")))
+        t1 = time.time()
+
+        print("Packed binary DAWG mapped in {0:.4f} seconds".format(t1 - t0))
+
+        if packed.num_nodes() != self._dawg.num_nodes():
+            print(u"Error: packed DAWG has {0} nodes, text DAWG has {1}"
+                .format(packed.num_nodes(), self._dawg.num_nodes()))
 
         print("Checking a set of random words:")
         self._test_true(u"abbadísarinnar")
@@ -167,6 +212,25 @@ class DawgTester:
                 else:
                     self._test_false(word)
 
+        print("Validating a batch of words:")
+        # All three-letter combinations, plus their two-letter prefixes
+        batch = [first + second + third
+            for first in Alphabet.order
+            for second in Alphabet.order
+            for third in Alphabet.order]
+        batch.extend(word[0:2] for word in batch[::len(Alphabet.order)])
+        t0 = time.time()
+        single = [self._dawg.find(word) for word in batch]
+        t1 = time.time()
+        many = self._dawg.find_many(batch)
+        t2 = time.time()
+        if many != single:
+            print(u"Error: find_many() and find() disagree")
+        print(u"{0} words, {1} valid: find() {2:.0f} words/sec, find_many() {3:.0f} words/sec"
+            .format(len(batch), sum(many), len(batch) / max(t1 - t0, 1e-6),
+                len(batch) / max(t2 - t1, 1e-6)))
+        print
+
         print("Finding permutations:")
         t0 = time.time()
         word = u"einstök"
@@ -238,10 +302,220 @@ class DawgTester:
                 print (u"{0} in match result but not in smallwords".format(word))
         print
 
+        print("Extended patterns:")
+        for pattern in [u"[aeiou]*[aeiou]{4}", u"^ein", u"st$", u"e[^aeiou]*"]:
+            print(u"{0} matches of \"{1}\"".format(len(self._dawg.find_matches(pattern)), pattern))
+        # Invalid patterns must be rejected instead of matching all or no words
+        for pattern in [u"^", u"$", u"^$", u"{2,5}", u"a{5,2}", u"a{-1}", u"a[]", u"a[b", u"a}", u"a#"]:
+            try:
+                self._dawg.find_matches(pattern)
+                print(u"Error: invalid pattern \"{0}\" was accepted".format(pattern))
+            except ValueError:
+                pass
+        print
+
+        print("Paging with a small budget:")
+        for query, page, find in [
+            (u"*ö*ö*", self._dawg.page_matches, self._dawg.find_matches),
+            (u"e??st??", self._dawg.page_matches, self._dawg.find_matches),
+            (u"einst?", self._dawg.page_permutations, self._dawg.iter_permutations)]:
+            words = []
+            token = None
+            calls = 0
+            while True:
+                budget = Budget(nodes = 30)
+                result, next_token = page(query, 10, token, budget = budget)
+                words.extend(result)
+                calls += 1
+                if budget.exhausted() and next_token is None:
+                    print(u"Error: paging \"{0}\" stopped although the budget ran out".format(query))
+                    break
+                if next_token is None:
+                    break
+                if next_token == token:
+                    # The call did not make any progress
+                    print(u"Error: paging \"{0}\" is stuck".format(query))
+                    break
+                token = next_token
+            if words != list(find(query)):
+                print(u"Error: pages of \"{0}\" differ from the full result".format(query))
+            print(u"{0} words of \"{1}\" in {2} calls".format(len(words), query, calls))
+        print
+
+        print("Finding placements:")
+        template = u"....r..a.t....."
+        rack = u"einstö?"
+        t0 = time.time()
+        placements = self._dawg.find_placements(template, rack)
+        t1 = time.time()
+        print(u"{0} placements of \"{1}\" on \"{2}\" found in {3:.2f} seconds"
+            .format(len(placements), rack, template, t1 - t0))
+        # Each placement must be a word that matches its part of the template
+        for start, word, blanks in placements:
+            pattern = template[start:start + len(word)].replace(u'.', u'?')
+            if word not in self._dawg.find_matches(pattern):
+                print(u"Error: placement \"{0}\" at {1} does not match the template".format(word, start))
+        # Navigations from successive start squares share the budget, and
+        # a budget of exactly the nodes visited must give the complete result
+        line, tiles = u"..............a", u"einstök"
+        budget = Budget()
+        full = self._dawg.find_placements(line, tiles, budget = budget)
+        nodes = budget.used()
+        budget = Budget(nodes = nodes)
+        if self._dawg.find_placements(line, tiles, budget = budget) != full or budget.exhausted():
+            print(u"Error: placements on \"{0}\" were cut short by a budget of {1} nodes".format(line, nodes))
+        budget = Budget(nodes = nodes - 1)
+        self._dawg.find_placements(line, tiles, budget = budget)
+        if not budget.exhausted():
+            print(u"Error: placements on \"{0}\" fit in a budget of {1} nodes".format(line, nodes - 1))
+        print(u"{0} placements of \"{1}\" on \"{2}\" visit {3} nodes"
+            .format(len(full), tiles, line, nodes))
+        print
+
+        for name, other in [("packed binary", packed), ("compact", compact), ("snapshot", snapshot)]:
+            print("Comparing {0} DAWG with text DAWG:".format(name))
+            for word in [u"einstök", u"pr?óf", u"ás?"]:
+                if other.find_permutations(word) != self._dawg.find_permutations(word):
+                    print(u"Error: permutations of \"{0}\" differ".format(word))
+            for word in [u"e??st??", u"f?r??t??n", u"??"]:
+                if other.find_matches(word) != self._dawg.find_matches(word):
+                    print(u"Error: matches of \"{0}\" differ".format(word))
+            if other.find_placements(template, rack) != placements:
+                print(u"Error: placements on \"{0}\" differ".format(template))
+            for word in smallwords:
+                if word not in other:
+                    print(u"Error: \"{0}\" was not found in {1} DAWG".format(word, name))
+
         print(u"Test finished")
 
         self._dawg = None
 
+    # Board lines for comparing move generation with a DAWG and a GADDAG,
+    # with racks to place on them
+    _LINES = [
+        (u".......a.......", u"einstök"),
+        (u"....r..a.t.....", u"einstö?"),
+        (u"..s....ó....n..", u"aðgrúti"),
+        (u"...hest.....k..", u"arnmið?"),
+        (u".b.r.......l.p.", u"eaiussö"),
+        (u"...............", u"prófun?")]
+
+    def run_gaddag(self, fname, relpath):
+        """ Compare move generation on board lines with a DAWG and a GADDAG """
+
+        print("DAWG and GADDAG move generation")
+
+        dawg = DawgDictionary()
+        dawg.load_binary(os.path.abspath(os.path.join(relpath, fname + ".dawg")))
+        gaddag = GaddagDictionary()
+        t0 = time.time()
+        gaddag.load_binary(os.path.abspath(os.path.join(relpath, fname + ".gaddag")))
+        t1 = time.time()
+
+        print("Packed binary GADDAG with {0} nodes mapped in {1:.4f} seconds"
+            .format(gaddag.num_nodes(), t1 - t0))
+
+        for word in [u"prófun", u"upphitun", u"blús", u"abs", u"halló", u"ertðu"]:
+            if gaddag.find(word) != dawg.find(word):
+                print(u"Error: \"{0}\" is found differently in the GADDAG".format(word))
+
+        total_dawg = total_gaddag = 0.0
+        for template, rack in DawgTester._LINES:
+            # Anchors are the empty squares next to tiles, as on the board,
+            # or all squares of an empty line
+            squares = [c != u'.' for c in template]
+            anchors = [i for i in range(len(template)) if not squares[i] and
+                ((i > 0 and squares[i - 1]) or (i + 1 < len(template) and squares[i + 1]))]
+            if not any(squares):
+                anchors = None
+            t0 = time.time()
+            by_dawg = dawg.find_placements(template, rack, anchors = anchors)
+            t1 = time.time()
+            by_gaddag = gaddag.find_placements(template, rack, anchors = anchors)
+            t2 = time.time()
+            total_dawg += t1 - t0
+            total_gaddag += t2 - t1
+            print(u"\"{0}\" with \"{1}\": {2} moves, DAWG {3:.1f} ms, GADDAG {4:.1f} ms"
+                .format(template, rack, len(by_dawg), (t1 - t0) * 1000, (t2 - t1) * 1000))
+            # The blanks may be placed differently, as the letters are taken
+            # from the rack in a different order
+            if [(s, w, len(b)) for s, w, b in by_gaddag] != [(s, w, len(b)) for s, w, b in by_dawg]:
+                print(u"Error: the DAWG and the GADDAG find different moves")
+        print(u"Total: DAWG {0:.1f} ms, GADDAG {1:.1f} ms".format(total_dawg * 1000, total_gaddag * 1000))
+
+        print(u"Test finished")
+
+    def run_board(self, fname, relpath, seed = 1):
+        """ Play a game on the board, where each move is the highest scoring one for
+            racks drawn from the bag, and time the generation of all legal moves """
+
+        print("Move generation on the board")
+
+        dawg = DawgDictionary()
+        t0 = time.time()
+        dawg.load(os.path.abspath(os.path.join(relpath, fname + ".text.dawg")))
+        t1 = time.time()
+        print("DAWG with {0} nodes loaded in {1:.2f} seconds".format(dawg.num_nodes(), t1 - t0))
+
+        rnd = random.Random(seed)
+        bag = list(Alphabet.full_bag())
+        rnd.shuffle(bag)
+        board = Board(dawg)
+        rack = []
+        timings = []
+        passes = 0
+        while passes < 2:
+            while len(rack) < Board.RACK_SIZE and bag:
+                rack.append(bag.pop())
+            if not rack:
+                break
+            t0 = time.time()
+            moves = board.generate_moves(u"".join(rack))
+            t1 = time.time()
+            timings.append(t1 - t0)
+            # The searches of all lines share a budget, and a budget of
+            # exactly the nodes visited must give all the moves
+            budget = Budget()
+            board.generate_moves(u"".join(rack), budget)
+            nodes = budget.used()
+            budget = Budget(nodes = nodes)
+            if ([repr(m) for m in board.generate_moves(u"".join(rack), budget)] !=
+                [repr(m) for m in moves] or budget.exhausted()):
+                print(u"Error: moves for \"{0}\" were cut short by a budget of {1} nodes"
+                    .format(u"".join(rack), nodes))
+            if not moves:
+                # Exchange the rack, if there are tiles to exchange with
+                passes += 1
+                bag.extend(rack)
+                rnd.shuffle(bag)
+                rack = []
+                continue
+            passes = 0
+            move = moves[0]
+            placed = [i for i, (row, col) in enumerate(move.squares()) if board.tile(row, col) is None]
+            t2 = time.time()
+            board.play(move)
+            t3 = time.time()
+            for i in placed:
+                rack.remove(u'?' if i in move.blanks else move.word[i])
+            print(u"{0} moves in {1:.1f} ms, best is {2} {3} at {4},{5} for {6} points, played in {7:.1f} ms"
+                .format(len(moves), (t1 - t0) * 1000, move.word, u"across" if move.horizontal else u"down",
+                    move.row, move.col, move.score, (t3 - t2) * 1000))
+            # Every run of two or more tiles on the board must be a word
+            for horizontal in (True, False):
+                for line in range(Board.SIZE):
+                    letters = [board.tile(line, pos) if horizontal else board.tile(pos, line)
+                        for pos in range(Board.SIZE)]
+                    for word in u"".join(c or u" " for c in letters).split():
+                        if len(word) > 1 and word not in dawg:
+                            print(u"Error: \"{0}\" on the board is not a word".format(word))
+
+        timings.sort()
+        print(u"{0} racks: median {1:.1f} ms, maximum {2:.1f} ms".format(len(timings),
+            timings[len(timings) // 2] * 1000, timings[-1] * 1000))
+
+        print(u"Test finished")
+
 
 def test():
     # Test navivation in the DAWG
@@ -249,6 +523,19 @@ def test():
     dt.run("ordalisti", "resources")
 
 
+def test_gaddag():
+    # Compare move generation with the DAWG and the GADDAG, which is
+    # built by dawgbuilder.run_skrafl_gaddag()
+    dt = DawgTester()
+    dt.run_gaddag("ordalisti", "resources")
+
+
+def test_board():
+    # Play a game with move generation on the board
+    dt = DawgTester()
+    dt.run_board("ordalisti", "resources")
+
+
 if __name__ == '__main__':
 
     test()
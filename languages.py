@@ -109,6 +109,8 @@ class Alphabet:
 
     # Letter bit pattern
     bit = [1 << n for n in range(len(order))]
+    # Bit of each letter, for fast lookup
+    letter_bit = dict(zip(order, bit))
 
     # Locale collation (sorting) map, initialized in _init()
     _lcmap = None # Case sensitive
@@ -127,6 +129,15 @@ class Alphabet:
         """ Return a pattern of bits indicating which letters are present in the word """
         return reduce(lambda x, y: x | y, [Alphabet.bit_of(c) for c in word], 0)
 
+    @staticmethod
+    def letter_mask(s):
+        """ Return a pattern of bits indicating which letters are present in the string,
+            ignoring any characters that are not in the alphabet """
+        mask = 0
+        for c in s:
+            mask |= Alphabet.letter_bit.get(c, 0)
+        return mask
+
     @staticmethod
     def bit_of(c):
         """ Returns the bit corresponding to a character in the alphabet """
@@ -25,9 +25,12 @@
 from flask import Flask
 from flask import render_template
 from flask import request
+from flask import jsonify
 
+import os
 import logging
 import time
+import threading
 
 import skraflpermuter
 
@@ -37,6 +40,32 @@ import skraflpermuter
 app = Flask(__name__)
 app.config['DEBUG'] = False
 
+# Set when the word database has been loaded and warmed up
+_ready = threading.Event()
+
+# Default and maximum number of words in a page returned by /page/
+_PAGE_SIZE = 100
+_MAX_PAGE_SIZE = 500
+
+def _warmup():
+    """ Load the word database and run representative queries through it,
+        so that the first user request does not pay for the load """
+    if not _ready.is_set():
+        skraflpermuter.Tabulator.word_db().warmup()
+        _ready.set()
+        logging.info(u"Instance {0} is ready".format(os.environ.get("INSTANCE_ID", "")))
+
+# When served by a pre-forking server that imports this module in its master
+# process (such as gunicorn --preload), set SKRAFL_SHARED_DAWG=1 to load the
+# word graph once into shared memory, before the worker processes are forked.
+# Set SKRAFL_PRELOAD=1 to load and warm up the word graph when this module is
+# imported, instead of upon the first request.
+
+if os.environ.get("SKRAFL_SHARED_DAWG"):
+    skraflpermuter.Tabulator.word_db().share()
+if os.environ.get("SKRAFL_SHARED_DAWG") or os.environ.get("SKRAFL_PRELOAD"):
+    _warmup()
+
 def _process_rack(rack):
     """ Process a given input rack
         Returns True if OK or False if the rack was invalid, i.e. contains invalid letters
@@ -84,17 +113,66 @@ def main():
             rack = u''
     if rack:
         # We have something to do: process the entered rack
-        # Currently we do not do anything useful with racks of more than 15 characters
-        rack = rack[0:15]
+        # Currently we do not do anything useful with racks of more than 15 characters,
+        # but patterns need room for their syntax
+        rack = rack[0:40] if rack.startswith(u'=') else rack[0:15]
         return _process_rack(rack)
     # If nothing to do, just show the main rack entry form
     return render_template("main.html")
 
+@app.route("/page/")
+def page():
+    """ Return a page of words as JSON, either permutations of a rack (GET /page/?rack=xxx)
+        or matches of a pattern (GET /page/?pattern=xxx), in alphabetical order.
+        The response contains a token, to be passed as the token parameter of the
+        following request to get the next page, or null if there are no more words.
+        The count parameter gives the number of words per page.
+    """
+    word_db = skraflpermuter.Tabulator.word_db()
+    budget = skraflpermuter.Tabulator.budget()
+    token = request.args.get('token') or None
+    count = max(1, min(request.args.get('count', _PAGE_SIZE, type=int), _MAX_PAGE_SIZE))
+    # Wildcards can be given as '?' or '_', as on the main page, and in racks also as '*'
+    try:
+        if 'pattern' in request.args:
+            query = (u'' + request.args['pattern'])[0:40].lower().replace(u'_', u'?')
+            words, token = word_db.page_matches(query, count, token, budget)
+        else:
+            query = (u'' + request.args.get('rack', u''))[0:15].lower()
+            query = query.replace(u'_', u'?').replace(u'*', u'?')
+            if query.count(u'?') > skraflpermuter.Tabulator._MAX_WILDCARDS:
+                # As on the main page, limit the size of the result set
+                return jsonify(error = u"Too many wildcards in rack"), 400
+            words, token = word_db.page_permutations(query, count, token, budget)
+    except ValueError:
+        return jsonify(error = u"Invalid pattern or token"), 400
+    return jsonify(words = words, token = token, truncated = budget.exhausted())
+
 @app.route("/help/")
 def help():
     """ Show help page """
     return render_template("help.html")
 
+@app.route("/_ah/warmup")
+def warmup():
+    """ Handler for App Engine warmup requests, which are sent to a new instance
+        before user traffic is routed to it (see inbound_services in app.yaml) """
+    _warmup()
+    return u"", 200
+
+@app.route("/ready/")
+def ready():
+    """ Readiness check: returns 200 once the word database is loaded and warmed up,
+        otherwise 503. As App Engine does not guarantee a warmup request, the
+        database is loaded here if that has not already been done. """
+    try:
+        _warmup()
+    except (IOError, OSError, ValueError):
+        # The word database could not be loaded
+        logging.exception(u"Word database failed to load")
+        return u"Not ready", 503
+    return u"Ready", 200
+
 # Run a default Flask web server for testing if invoked directly as a main program
 
 if __name__ == "__main__":
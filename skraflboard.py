@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+""" SCRABBLE(tm) board and move generator
+
+    This module implements a main class named Board and a helper
+    class named Move.
+
+    Board holds the tiles on a 15x15 board with premium squares and generates
+    all legal moves for a rack, ranked by score, in the manner of Appel and
+    Jacobson: each row and each column is a line of the board, where words must
+    cover an anchor square (an empty square next to a tile) and each letter
+    placed must form a valid word with the tiles above and below it (or to the
+    left and right of it, for a column). The letters allowed on each empty square
+    are kept in a cross-check, a bit pattern as in Alphabet.bit, along with the
+    score of the tiles in the cross word. When a move is played, only the
+    cross-checks of the squares at the ends of the lines that it touches are
+    updated, instead of recomputing those of the whole board.
+
+    The words on a line are found by DawgDictionary.find_placements(), or by
+    GaddagDictionary.find_placements() if a GADDAG is given, with the anchors
+    and cross-checks of the line. See dawgdictionary.py.
+
+    Note: SCRABBLE is a registered trademark. This software or its author
+    are in no way affiliated with or endorsed by the owners or licensees
+    of the SCRABBLE trademark.
+
+"""
+
+from languages import Alphabet
+
+
+class Move:
+
+    """ A word placed on the board, starting at a square and going across
+        (horizontal) or down. Blanks is a tuple of the positions in the word
+        that are filled by blanks, tiles is the number of tiles that the move
+        takes from the rack and score is its score on the board.
+    """
+
+    def __init__(self, row, col, horizontal, word, blanks, tiles, score):
+        self.row = row
+        self.col = col
+        self.horizontal = horizontal
+        self.word = word
+        self.blanks = blanks
+        self.tiles = tiles
+        self.score = score
+
+    def squares(self):
+        """ Return a list of the (row, col) squares covered by the word """
+        if self.horizontal:
+            return [(self.row, self.col + i) for i in range(len(self.word))]
+        return [(self.row + i, self.col) for i in range(len(self.word))]
+
+    def __repr__(self):
+        return u"<Move {0}{1} {2} {3} {4}>".format(u"ABCDEFGHIJKLMNO"[self.row], self.col + 1,
+            u"across" if self.horizontal else u"down", self.word, self.score).encode('utf-8')
+
+
+class Board:
+
+    """ A board with tiles on it, along with the cross-checks and cross word
+        scores of its empty squares for moves in either direction.
+
+        Squares are indexed by (row, col). Internally, the board is also viewed
+        as lines: direction 0 is the rows, for horizontal moves, and direction 1
+        the columns, for vertical moves, and a square is at a position in a line.
+        The cross-check of a square for a direction is None if there are no tiles
+        next to it across that direction, since any letter may then be placed on
+        it, and its cross word score is then None as well.
+
+        The cross-checks are calculated with the DAWG. Moves are generated with
+        the GADDAG if one is given, or else with the DAWG.
+    """
+
+    SIZE = 15
+    RACK_SIZE = 7
+    # Bonus for using all the tiles in the rack in a single move
+    BINGO_BONUS = 50
+
+    # Premium squares: triple word (W), double word (w),
+    # triple letter (L) and double letter (l)
+    _PREMIUMS = [
+        u"W..l...W...l..W",
+        u".w...L...L...w.",
+        u"..w...l.l...w..",
+        u"l..w...l...w..l",
+        u"....w.....w....",
+        u".L...L...L...L.",
+        u"..l...l.l...l..",
+        u"W..l...w...l..W",
+        u"..l...l.l...l..",
+        u".L...L...L...L.",
+        u"....w.....w....",
+        u"l..w...l...w..l",
+        u"..w...l.l...w..",
+        u".w...L...L...w.",
+        u"W..l...W...l..W"
+    ]
+
+    _LETTER_MULT = { u'L': 3, u'l': 2 }
+    _WORD_MULT = { u'W': 3, u'w': 2 }
+
+    def __init__(self, dawg, gaddag = None):
+        self._dawg = dawg
+        self._generator = dawg if gaddag is None else gaddag
+        size = Board.SIZE
+        # The letter on each square, or None, and whether it is a blank
+        self._tiles = [[None] * size for _ in range(size)]
+        self._blanks = [[False] * size for _ in range(size)]
+        self._count = 0
+        # The template of each line, by direction, as for find_placements()
+        self._templates = [[u'.' * size] * size, [u'.' * size] * size]
+        # The cross-check and cross word score of each square, by direction, line and position
+        self._checks = [[[None] * size for _ in range(size)] for _ in range(2)]
+        self._xscores = [[[None] * size for _ in range(size)] for _ in range(2)]
+        # The letter and word multipliers of each square, by direction, line and position
+        self._letter_mult = [[[1] * size for _ in range(size)] for _ in range(2)]
+        self._word_mult = [[[1] * size for _ in range(size)] for _ in range(2)]
+        for row in range(size):
+            for col in range(size):
+                p = Board._PREMIUMS[row][col]
+                for d, line, pos in ((0, row, col), (1, col, row)):
+                    self._letter_mult[d][line][pos] = Board._LETTER_MULT.get(p, 1)
+                    self._word_mult[d][line][pos] = Board._WORD_MULT.get(p, 1)
+
+    @staticmethod
+    def _square(d, line, pos):
+        """ Return the (row, col) square at a position in a line """
+        return (line, pos) if d == 0 else (pos, line)
+
+    def tile(self, row, col):
+        """ Return the letter on a square, or None if it is empty """
+        return self._tiles[row][col]
+
+    def is_blank(self, row, col):
+        """ Return True if the tile on a square is a blank """
+        return self._blanks[row][col]
+
+    def is_empty(self):
+        """ Return True if there are no tiles on the board """
+        return self._count == 0
+
+    def cross_check(self, row, col, horizontal = True):
+        """ Return a bit pattern, as in Alphabet.bit, of the letters that may be placed
+            on an empty square by a move in the given direction, forming valid cross words """
+        if horizontal:
+            check = self._checks[0][row][col]
+        else:
+            check = self._checks[1][col][row]
+        return Alphabet.all_bits_set() if check is None else check
+
+    def anchors(self):
+        """ Return a set of the anchor squares of the board: the empty squares
+            next to a tile, or the center square if the board is empty """
+        if self.is_empty():
+            center = Board.SIZE // 2
+            return set([(center, center)])
+        size = Board.SIZE
+        tiles = self._tiles
+        result = set()
+        for row in range(size):
+            for col in range(size):
+                if tiles[row][col] is None and (
+                    (row > 0 and tiles[row - 1][col] is not None) or
+                    (row < size - 1 and tiles[row + 1][col] is not None) or
+                    (col > 0 and tiles[row][col - 1] is not None) or
+                    (col < size - 1 and tiles[row][col + 1] is not None)):
+                    result.add((row, col))
+        return result
+
+    def _score(self, d, line, start, word, blanks):
+        """ Return the number of tiles placed by a word at a position in a line,
+            and the score of the move """
+        template = self._templates[d][line]
+        letter_mult = self._letter_mult[d][line]
+        word_mult = self._word_mult[d][line]
+        xscores = self._xscores[d][line]
+        board_blanks = self._blanks
+        scores = Alphabet.scores
+        main = 0
+        mult = 1
+        cross = 0
+        tiles = 0
+        for i, c in enumerate(word):
+            pos = start + i
+            if template[pos] != u'.':
+                # A tile on the board, without premiums
+                row, col = Board._square(d, line, pos)
+                if not board_blanks[row][col]:
+                    main += scores.get(c, 0)
+                continue
+            tiles += 1
+            ls = 0 if i in blanks else scores.get(c, 0) * letter_mult[pos]
+            wm = word_mult[pos]
+            main += ls
+            mult *= wm
+            xs = xscores[pos]
+            if xs is not None:
+                # The cross word formed by the tile
+                cross += (xs + ls) * wm
+        score = main * mult + cross
+        if tiles == Board.RACK_SIZE:
+            score += Board.BINGO_BONUS
+        return tiles, score
+
+    def move(self, row, col, horizontal, word, blanks = ()):
+        """ Return a Move for a word placed on the board, with its score. Raises ValueError
+            if the word does not fit on the board or conflicts with the tiles on it.
+            The words formed are not checked. """
+        size = Board.SIZE
+        d, line, start = (0, row, col) if horizontal else (1, col, row)
+        if not (0 <= line < size and 0 <= start and start + len(word) <= size) or not word:
+            raise ValueError(u"Word '{0}' does not fit on the board".format(word))
+        template = self._templates[d][line]
+        for i, c in enumerate(word):
+            if template[start + i] != u'.' and template[start + i] != c:
+                raise ValueError(u"Word '{0}' conflicts with the tiles on the board".format(word))
+        blanks = tuple(blanks)
+        tiles, score = self._score(d, line, start, word, blanks)
+        return Move(row, col, horizontal, word, blanks, tiles, score)
+
+    def play(self, move):
+        """ Place the tiles of a move on the board, and update the cross-checks
+            of the squares that are affected """
+        d = 0 if move.horizontal else 1
+        placed = []
+        for i, (row, col) in enumerate(move.squares()):
+            if self._tiles[row][col] is None:
+                self._set_tile(row, col, move.word[i], i in move.blanks)
+                placed.append((row, col))
+        # The cross-checks that depend on the tiles in a line change when tiles are
+        # placed in it: those of the empty squares at either end of the run of tiles
+        # through each new tile, for moves across that line. Along the line of the
+        # move, the run is the word itself.
+        if placed:
+            self._update_ends(d, *placed[0])
+        for row, col in placed:
+            self._update_ends(1 - d, row, col)
+
+    def _set_tile(self, row, col, letter, blank):
+        """ Put a tile on an empty square """
+        self._tiles[row][col] = letter
+        self._blanks[row][col] = blank
+        self._count += 1
+        for d, line, pos in ((0, row, col), (1, col, row)):
+            t = self._templates[d][line]
+            self._templates[d][line] = t[:pos] + letter + t[pos + 1:]
+            self._checks[d][line][pos] = None
+            self._xscores[d][line][pos] = None
+
+    def _update_ends(self, d, row, col):
+        """ Update the cross-checks of the empty squares at either end of the run
+            of tiles through a square, in a line of direction d. The run forms the
+            cross word of moves in the other direction through those squares. """
+        line, pos = (row, col) if d == 0 else (col, row)
+        template = self._templates[d][line]
+        size = Board.SIZE
+        first = pos
+        while first > 0 and template[first - 1] != u'.':
+            first -= 1
+        last = pos
+        while last < size - 1 and template[last + 1] != u'.':
+            last += 1
+        if first > 0:
+            self._update_check(1 - d, *Board._square(d, line, first - 1))
+        if last < size - 1:
+            self._update_check(1 - d, *Board._square(d, line, last + 1))
+
+    def _update_check(self, d, row, col):
+        """ Calculate the cross-check and cross word score of an empty square,
+            for moves in direction d, from the tiles next to it in a line
+            of the other direction """
+        # The line across the move direction, and the position of the square in it
+        line, pos = (col, row) if d == 0 else (row, col)
+        template = self._templates[1 - d][line]
+        size = Board.SIZE
+        first = pos
+        while first > 0 and template[first - 1] != u'.':
+            first -= 1
+        last = pos
+        while last < size - 1 and template[last + 1] != u'.':
+            last += 1
+        cline, cpos = (row, col) if d == 0 else (col, row)
+        if first == last:
+            # No tiles next to the square
+            self._checks[d][cline][cpos] = None
+            self._xscores[d][cline][cpos] = None
+            return
+        prefix = template[first:pos]
+        suffix = template[pos + 1:last + 1]
+        check = 0
+        for word in self._dawg.find_matches(prefix + u'?' + suffix):
+            check |= Alphabet.letter_bit.get(word[len(prefix)], 0)
+        xscore = 0
+        for p in range(first, last + 1):
+            if p != pos:
+                r, c = Board._square(1 - d, line, p)
+                if not self._blanks[r][c]:
+                    xscore += Alphabet.scores.get(self._tiles[r][c], 0)
+        self._checks[d][cline][cpos] = check
+        self._xscores[d][cline][cpos] = xscore
+
+    def generate_moves(self, rack, budget = None):
+        """ Return a list of all legal moves for a rack, which may contain blanks ('?'),
+            ranked by score, highest first. Moves with the same score are ordered by their
+            square and direction. If a dawgdictionary.Budget is given, it is shared by the
+            searches of all lines, and the moves found when it runs out are returned. """
+        size = Board.SIZE
+        anchors = self.anchors()
+        result = []
+        for d in range(2):
+            for line in range(size):
+                checks = self._checks[d][line]
+                line_anchors = [pos for pos in range(size)
+                    if Board._square(d, line, pos) in anchors and checks[pos] != 0]
+                if not line_anchors:
+                    continue
+                template = self._templates[d][line]
+                xscores = self._xscores[d][line]
+                for start, word, blanks in self._generator.find_placements(template, rack,
+                    2, budget, line_anchors, checks):
+                    tiles, score = self._score(d, line, start, word, blanks)
+                    if d == 1 and tiles == 1:
+                        # A single tile that also forms a word across has been
+                        # found as a horizontal move
+                        if xscores[template.find(u'.', start)] is not None:
+                            continue
+                    row, col = Board._square(d, line, start)
+                    result.append(Move(row, col, d == 0, word, blanks, tiles, score))
+                if budget is not None and budget.exhausted():
+                    break
+            if budget is not None and budget.exhausted():
+                break
+        result.sort(key = lambda m: (-m.score, m.row, m.col, not m.horizontal))
+        return result
@@ -26,98 +26,293 @@
 
 """
 
-import os
-import itertools
 import codecs
 import logging
 import time
+import threading
+
+from collections import OrderedDict
 
 import dawgdictionary
 
 from languages import Alphabet
 
 
+class ResultCache:
+
+    """ A bounded, thread-safe least-recently-used cache of query results.
+
+    Each entry maps a key to a list of words. The cache is bounded both by the
+    number of entries and by the total number of words in all entries; the
+    least recently used entries are evicted when either bound is exceeded.
+    Results that are larger than the total bound by themselves are not cached.
+
+    """
+
+    def __init__(self, max_entries, max_words):
+        self._max_entries = max_entries
+        self._max_words = max_words
+        self._entries = OrderedDict()
+        self._words = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Return a copy of the cached result for the key, or None if not cached """
+        with self._lock:
+            result = self._entries.pop(key, None)
+            if result is None:
+                self._misses += 1
+                return None
+            # Re-insert the entry to mark it as the most recently used
+            self._entries[key] = result
+            self._hits += 1
+            return list(result)
+
+    def put(self, key, result):
+        """ Store a result in the cache, evicting older entries as required """
+        size = len(result)
+        if size > self._max_words:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._words -= len(old)
+            self._entries[key] = tuple(result)
+            self._words += size
+            while len(self._entries) > self._max_entries or self._words > self._max_words:
+                _, evicted = self._entries.popitem(last = False)
+                self._words -= len(evicted)
+                self._evictions += 1
+
+    def clear(self):
+        """ Remove all entries from the cache, keeping the statistics """
+        with self._lock:
+            self._entries.clear()
+            self._words = 0
+
+    def stats(self):
+        """ Return a dict of cache statistics """
+        with self._lock:
+            return dict(entries = len(self._entries), words = self._words,
+                hits = self._hits, misses = self._misses, evictions = self._evictions)
+
+
 class WordDatabase:
 
     """ Maintains the set of permitted words and judges whether a word is acceptable.
     
-    This class loads and maintains a Directed Acyclic Word Graph (DAWG) of valid words.
+    This class queries a Directed Acyclic Word Graph (DAWG) of valid words.
     The DAWG is used to check racks for validity and to find all valid words embedded
     within a rack.
 
     The word database is fairly big (several megabytes) so it is important to avoid multiple
-    instances of it. The Tabulator implementation below makes sure to use a singleton
-    instance of the WordDatabase class, in the class variable _word_db, across all invocations.
-
-    The word graph is loaded from a text file, 'ordalisti.text.dawg', assumed to be in
-    the 'resources' folder. This file is separately pre-generated using DawgBuilder.run_skrafl()
+    copies of it. The graph itself is obtained from the dawgdictionary.Wordbase registry,
+    which loads each dictionary once per process and shares it between all users.
+    The Tabulator implementation below also uses a singleton instance of the WordDatabase
+    class, in the class variable _word_db, so that its result caches are shared across
+    all invocations.
+
+    The word graph is loaded from files named 'ordalisti.*', assumed to be in
+    the 'resources' folder. These files are separately pre-generated using DawgBuilder.run_skrafl()
     in dawgbuilder.py.
 
     The graph contains a cleaned-up version of a database originally from bin.arnastofnun.is,
     used under license conditions from "Stofnun Árna Magnússonar í íslenskum fræðum".
 
+    Results of find_permutations() and find_matches() are kept in LRU caches.
+    The permutations of a rack depend only on the letters in it, not on their
+    order, so the rack is sorted to form the cache key. Anagrams of a popular
+    rack thus share the same cache entry. The caches belong to a particular
+    graph, and are replaced when the graph is reloaded in the Wordbase registry.
+
+    The query functions accept an optional dawgdictionary.Budget, which limits
+    the number of graph nodes visited and the time spent. If it runs out, the
+    words found so far are returned and budget.exhausted() is True. Such
+    partial results are not cached.
+
     """
 
-    def __init__(self):
-        # We maintain the list of permitted words in a DAWG dictionary
+    # Bounds on the number of cached results and the total number of words in them
+    _CACHE_ENTRIES = 2000
+    _CACHE_WORDS = 250000
+
+    def __init__(self, name = dawgdictionary.Wordbase.DEFAULT):
+        # We maintain the list of permitted words in a DAWG dictionary,
+        # identified by its name in the Wordbase registry.
         # The DAWG is lazily loaded into memory upon first use
-        self._dawg = None
+        self._name = name
+        # The graph that the result caches belong to, and the caches
+        self._caches = (None, None, None)
+
+    def _dawg(self):
+        """ Return the DAWG, loading it if required """
+        return dawgdictionary.Wordbase.dawg(self._name)
+
+    def _dawg_and_caches(self):
+        """ Return the DAWG and its permutation and pattern result caches.
+            If the graph has been reloaded, new caches are started for it. """
+        dawg = self._dawg()
+        caches = self._caches
+        if caches[0] is not dawg:
+            # Results that are still being calculated from the old graph
+            # will go into the old caches, which are discarded
+            caches = (dawg,
+                ResultCache(WordDatabase._CACHE_ENTRIES, WordDatabase._CACHE_WORDS),
+                ResultCache(WordDatabase._CACHE_ENTRIES, WordDatabase._CACHE_WORDS))
+            self._caches = caches
+        return caches
 
-    def _load(self):
-        """ Load word lists into memory from static preprocessed text files """
-        if self._dawg is not None:
-            # Already loaded, nothing to do
-            return
-        fname = os.path.abspath(os.path.join("resources", "ordalisti.text.dawg"))
-        logging.info(u"Loading graph from file {0}".format(fname))
+    def initialize(self):
+        """ Force preloading of word lists into memory """
+        self._dawg()
+
+    def warmup(self):
+        """ Load the word graph and run a few representative queries, to touch
+            the structures used by typical requests before any traffic arrives.
+            Returns the number of seconds taken. """
         t0 = time.time()
-        self._dawg = dawgdictionary.DawgDictionary()
-        self._dawg.load(fname)
+        self.initialize()
+        for word in (u"prófun", u"blús", u"abs"):
+            self.is_valid_word(word)
+        for rack in (u"einstök", u"pr?óf"):
+            self.find_permutations(rack)
+            self.find_permutations(rack + u"?")
+        self.find_matches(u"e??st??")
         t1 = time.time()
-        logging.info(u"Loaded {0} graph nodes in {1:.2f} seconds".format(self._dawg.num_nodes(), t1 - t0))
+        logging.info(u"Word database warmed up in {0:.2f} seconds".format(t1 - t0))
+        return t1 - t0
 
-    def initialize(self):
-        """ Force preloading of word lists into memory """
-        if self._dawg is None:
-            self._load()
+    def share(self):
+        """ Load the word graph into shared memory. This is intended for the master
+            process of a pre-forking server, before the workers are forked, so that
+            all workers share a single copy of the graph instead of loading their own. """
+        dawgdictionary.Wordbase.load_shared(self._name)
 
     def is_valid_word(self, word):
         """ Checks whether a word is found in the list of legal words """
         if not word:
             return False
-        if self._dawg is None:
-            self._load()
-        assert self._dawg is not None
-        return self._dawg.find(word)
+        return self._dawg().find(word)
 
     def __contains__(self, word):
         """ Enable simple lookup syntax: "word" in word_db """
         return self.is_valid_word(word)
 
-    def find_permutations(self, rack):
+    def are_valid_words(self, words):
+        """ Checks a batch of words, returning a list of booleans in the same order """
+        return self._dawg().find_many(words)
+
+    def find_permutations(self, rack, budget = None):
         """ Find all embedded words within a rack """
         if not rack:
             return None
-        if self._dawg is None:
-            self._load()
-        assert self._dawg is not None
-        return self._dawg.find_permutations(rack)
-
-    def find_matches(self, pattern, sort=True):
+        key = u''.join(sorted(rack))
+        dawg, perm_cache, _ = self._dawg_and_caches()
+        result = perm_cache.get(key)
+        if result is None:
+            result = dawg.find_permutations(rack, budget = budget)
+            self._cache(perm_cache, key, result, budget)
+        return result
+
+    def find_scored_permutations(self, rack, budget = None):
+        """ Find all embedded words within a rack, returning a list of (word, score, blanks)
+            tuples where score does not count blank tiles, and blanks is a tuple of the
+            positions in the word that are filled by blanks. Each word occurs once,
+            with the blanks placed so that the score is as high as possible. """
+        if not rack:
+            return None
+        # The key is distinguished from permutation keys, which are plain strings
+        key = (u'#', u''.join(sorted(rack)))
+        dawg, perm_cache, _ = self._dawg_and_caches()
+        result = perm_cache.get(key)
+        if result is None:
+            result = dawg.find_permutations(rack, scored = True, budget = budget)
+            self._cache(perm_cache, key, result, budget)
+        return result
+
+    def find_combinations(self, rack, budget = None):
+        """ Find all embedded words within a rack, as well as words formed from the whole
+            rack plus one additional letter, in a single traversal. Returns a list of
+            (word, letter) tuples where letter is None for embedded words. """
+        if not rack:
+            return None
+        # The key is distinguished from permutation keys, which are plain strings
+        key = (u'+', u''.join(sorted(rack)))
+        dawg, perm_cache, _ = self._dawg_and_caches()
+        result = perm_cache.get(key)
+        if result is None:
+            result = dawg.find_combinations(rack, budget = budget)
+            self._cache(perm_cache, key, result, budget)
+        return result
+
+    def find_matches(self, pattern, sort=True, budget=None):
         """ Find all words that match a pattern """
         if not pattern:
             return None
-        if self._dawg is None:
-            self._load()
-        assert self._dawg is not None
-        return self._dawg.find_matches(pattern, sort)
+        key = (pattern, sort)
+        dawg, _, match_cache = self._dawg_and_caches()
+        result = match_cache.get(key)
+        if result is None:
+            result = dawg.find_matches(pattern, sort, budget)
+            self._cache(match_cache, key, result, budget)
+        return result
+
+    def find_placements(self, template, rack, budget = None):
+        """ Find all words that can be placed on a line of the board, given as a
+            template with letters for the tiles on it and '.' for empty squares,
+            by filling empty squares from the rack. Returns a list of
+            (start, word, blanks) tuples; see DawgDictionary.find_placements() """
+        if not template or not rack:
+            return []
+        return self._dawg().find_placements(template, rack, budget = budget)
+
+    def iter_permutations(self, rack, limit=None, budget=None):
+        """ Generate embedded words within a rack, stopping when the caller stops """
+        if not rack:
+            return iter(())
+        return self._dawg().iter_permutations(rack, limit=limit, budget=budget)
+
+    def iter_matches(self, pattern, limit=None, budget=None):
+        """ Generate words that match a pattern, stopping when the caller stops """
+        if not pattern:
+            return iter(())
+        return self._dawg().iter_matches(pattern, limit, budget)
+
+    def page_permutations(self, rack, count, token=None, budget=None):
+        """ Find a page of embedded words within a rack, in alphabetical order, returning
+            a tuple (words, token) where token continues the query on the next page,
+            or is None if there are no more words. Raises ValueError if the given
+            token is invalid or belongs to another query. """
+        if not rack:
+            return [], None
+        return self._dawg().page_permutations(rack, count, token, budget=budget)
 
-    def navigate(self, nav):
+    def page_matches(self, pattern, count, token=None, budget=None):
+        """ Find a page of words that match a pattern, as in page_permutations() """
+        if not pattern:
+            return [], None
+        return self._dawg().page_matches(pattern, count, token, budget)
+
+    def cache_stats(self):
+        """ Return hit/miss statistics for the permutation and pattern caches """
+        _, perm_cache, match_cache = self._dawg_and_caches()
+        return dict(permutations = perm_cache.stats(), matches = match_cache.stats())
+
+    def navigate(self, nav, budget=None):
         """ Use a generic navigator to traverse the graph """
-        if self._dawg is None:
-            self._load()
-        assert self._dawg is not None
-        self._dawg.navigate(nav)
+        self._dawg().navigate(nav, budget)
+
+    @staticmethod
+    def _cache(cache, key, result, budget):
+        """ Store a query result in a cache, unless it is partial """
+        if budget is not None and budget.exhausted():
+            logging.info(u"Query {0} ran out of budget after {1} results"
+                .format(repr(key), len(result)))
+            return
+        cache.put(key, result)
 
 
 class Tabulator:
@@ -134,18 +329,43 @@ class Tabulator:
     # all Tabulator instances throughout a server session
     _word_db = None
 
+    # The maximum number of wildcards in a permutation search
+    _MAX_WILDCARDS = 5
+
+    # Characters, other than letters, allowed in the extended pattern language;
+    # see dawgdictionary._CompiledPattern
+    _PATTERN_SYNTAX = u"*[]^${},0123456789"
+
+    # The maximum number of graph nodes visited, and seconds spent,
+    # by the search for a single rack or pattern
+    _NODE_BUDGET = 50000
+    _TIME_BUDGET = 2.0
+
+    @staticmethod
+    def word_db():
+        """ Return the singleton WordDatabase instance, creating it if required """
+        if Tabulator._word_db is None:
+            Tabulator._word_db = WordDatabase()
+        return Tabulator._word_db
+
+    @staticmethod
+    def budget():
+        """ Return a new budget limiting the work done on behalf of a single request """
+        return dawgdictionary.Budget(Tabulator._NODE_BUDGET, Tabulator._TIME_BUDGET)
+
     def __init__(self):
         self._counter = 0
         self._allwords = []
         self._highscore = 0
         self._highwords = []
         self._combinations = { }
+        self._blanks = { } # Positions of blank tiles within permutations, by word
         self._rack = u''
         self._rack_is_valid = False # True if the rack is itself a valid word
         self._pattern = False # True if the result is a pattern match ('=')
-        if Tabulator._word_db is None:
-            # The word database will be lazily loaded from file upon first use
-            Tabulator._word_db = WordDatabase()
+        self._truncated = False # True if the search was cut short
+        # The word database will be lazily loaded from file upon first use
+        Tabulator.word_db()
 
     def process(self, rack):
         """ Generate the data that will be shown to the user on the result page.
@@ -164,8 +384,10 @@ class Tabulator:
         self._highscore = 0
         self._highwords = []
         self._combinations = { }
+        self._blanks = { }
         self._rack = u''
         self._pattern = False
+        self._truncated = False
         # Do a sanity check on the input by calculating its raw score, thereby
         # checking whether all the letters are valid
         score = 0
@@ -184,7 +406,10 @@ class Tabulator:
                 if ch in Alphabet.upper:
                     # Uppercase: find corresponding lowercase letter
                     ch = Alphabet.lowercase(ch)
-                if ch in u'?_*':
+                if self._pattern and ch in Tabulator._PATTERN_SYNTAX:
+                    # Pattern syntax, including '*' for any sequence of letters
+                    pass
+                elif ch in u'?_*':
                     # This is one of the allowed wildcard characters
                     wildcards += 1
                     ch = u'?'
@@ -194,49 +419,56 @@ class Tabulator:
         except KeyError:
             # A letter in the rack is not valid, even after conversion to lower case
             return False
-        if not self._pattern and (wildcards > 2):
+        if not self._pattern and (wildcards > Tabulator._MAX_WILDCARDS):
             # Too many wildcards in a permutation search - need to constrain result set size
             return False
         # The rack contains only valid letters
         self._rack = rack_lower
-        # Generate combinations
+        # Limit the work done on behalf of a single request. If the budget
+        # runs out, the words found so far are shown, flagged as incomplete.
+        budget = Tabulator.budget()
         if not self._pattern and not wildcards:
-            # If no wildcards given, check combinations with one additional letter
-            query = self._rack + u'?'
-            # Permute the rack with one additional letter
-            p = self._word_db.find_permutations(query)
-            # Check the permutations to find valid words and their scores
-            if p is not None:
-                for word in p:
-                    # Only interested in full-length permutations, i.e. with the additional letter
-                    if len(word) == len(query):
-                        # Find out which letter was added
-                        addedletter = Alphabet.string_subtract(word, self._rack)
-                        self._add_combination(addedletter, word)
+            # No wildcards given: find permutations as well as combinations with
+            # one additional letter, in a single traversal of the graph
+            p = self._word_db.find_combinations(self._rack, budget)
+            for word, addedletter in p:
+                if addedletter is not None:
+                    # The whole rack plus the additional letter
+                    self._add_combination(addedletter, word)
+                elif len(word) >= 2:
+                    # Don't show single letter words
+                    self._add_permutation(word, self.score(word))
+            self._truncated = budget.exhausted()
+            return True
         # Check permutations
         # The shortest possible rack to check for permutations is 2 letters
         if len(self._rack) < 2:
             return True
         if self._pattern:
             # Use pattern matching
-            p = self._word_db.find_matches(self._rack, True) # We'd like a sorted result
-        else:
-            # Find permutations
-            p = self._word_db.find_permutations(self._rack)
+            try:
+                p = self._word_db.find_matches(self._rack, True, budget) # We'd like a sorted result
+            except ValueError:
+                # Invalid pattern syntax
+                return False
+            if p is None:
+                return True
+            for word in p:
+                if len(word) >= 2:
+                    # Don't show single letter words
+                    self._add_permutation(word, self.score(word))
+            self._truncated = budget.exhausted()
+            return True
+        # Find permutations, with their scores and the positions of the blank tiles,
+        # which are calculated during the traversal of the graph
+        p = self._word_db.find_scored_permutations(self._rack, budget)
         if p is None:
             return True
-        for word in p:
-            if len(word) < 2:
+        for word, score, blanks in p:
+            if len(word) >= 2:
                 # Don't show single letter words
-                continue
-            # Calculate the basic score of the word
-            score = self.score(word)
-            if wildcards and not self._pattern:
-                # Complication: Make sure we don't count the score of the wildcard tile(s)
-                wildchars = Alphabet.string_subtract(word, self._rack)
-                # What we have left are the wildcard substitutes: subtract'em
-                score -= self.score(wildchars)
-            self._add_permutation(word, score)
+                self._add_permutation(word, score, blanks)
+        self._truncated = budget.exhausted()
         # Successful
         return True
 
@@ -251,10 +483,12 @@ class Tabulator:
             s = 0
         return s
 
-    def _add_permutation(self, word, score):
+    def _add_permutation(self, word, score, blanks = ()):
         """ Add a valid permulation to the tabulation result """
         self._counter += 1
         self._allwords.append(word + " (" + str(score) + ")")
+        if blanks:
+            self._blanks[word] = blanks
         if score > self._highscore:
             # New high scoring word: note it and start a new list
             self._highscore = score
@@ -282,6 +516,17 @@ class Tabulator:
         """ Returns a list of all the valid letter permulations in the rack """
         return self._allwords
         
+    def marked(self, w):
+        """ Returns a list of (letter, is_blank) tuples for a word as returned
+            by allwords(), for display with the blank tiles marked """
+        word = w.split()[0]
+        blanks = self._blanks.get(word, ())
+        return [(c, ix in blanks) for ix, c in enumerate(word)]
+
+    def truncated(self):
+        """ Returns True if the search was cut short and the result is incomplete """
+        return self._truncated
+
     def highscore(self):
         """Returns the highest scoring letter permutation (by plain summation) in the rack"""
         return self._highscore